@@ -0,0 +1,284 @@
+import time
+import asyncio
+from openai import RateLimitError
+
+try:
+    from .azure_client import AzureAIClient
+    from .singleflight import AsyncSingleFlight
+    from .rate_limiter import retry_after
+    from .backends import FAILOVER_ERRORS
+    from .cancellation import RequestCancelled
+    from .deadline import DeadlineExceeded
+    from .metrics import metrics
+except ImportError:
+    from azure_client import AzureAIClient
+    from singleflight import AsyncSingleFlight
+    from rate_limiter import retry_after
+    from backends import FAILOVER_ERRORS
+    from cancellation import RequestCancelled
+    from deadline import DeadlineExceeded
+    from metrics import metrics
+
+
+class _AsyncPrefetched:
+    """Stream asincrono di cui è già stato letto il primo chunk"""
+
+    def __init__(self, stream, first):
+        self.stream = stream
+        self.first = first
+
+    async def __aiter__(self):
+        if self.first is not None:
+            yield self.first
+        async for chunk in self.stream:
+            yield chunk
+
+    async def close(self):
+        await self.stream.close()
+
+
+class AsyncAzureAIClient(AzureAIClient):
+    """Variante asincrona di AzureAIClient: achat/achat_stream non bloccano il processo"""
+
+    def __init__(self):
+        super().__init__()
+
+        self.async_client = self.pool.primary.async_client
+        self.async_flights = AsyncSingleFlight(coalesce=self.flights.coalesce)
+
+    def upstream_async(self, messages, stream=False, use_cache=True, deadline=None, session_id=None, cancel=None):
+        """Come upstream(), ma ritorna un generatore asincrono"""
+        # Senza più nessuno che legge, il task della chiamata viene cancellato ovunque sia fermo
+        produce = lambda: self._arequest(messages, stream, use_cache, deadline, session_id)
+        return self.async_flights.stream(self.request_key(messages), produce, cancel)
+
+    async def _acreate(self, messages, stream, deployment=None, deadline=None, session_id=None):
+        """Come _create(), ma attese e retry non bloccano l'event loop"""
+        estimate = self.estimate_tokens(messages)
+        backends = self.pool.ranked(deployment)
+        start = time.time()
+        for i, backend in enumerate(backends):
+            last = i == len(backends) - 1
+            if not last and not backend.limiter.try_acquire(estimate):
+                continue
+            try:
+                response = await backend.resilience.call_async(
+                    lambda: self._acreate_once(backend, messages, stream, estimate, acquire=last, deadline=deadline),
+                    hedge=stream, attempts=None if last else 1, deadline=deadline,
+                    on_discard=lambda loser, backend=backend: self._adiscard(loser, backend, estimate, start,
+                                                                             session_id, stream)
+                )
+                return response, estimate, backend
+            except FAILOVER_ERRORS as e:
+                if last:
+                    raise
+                # Il backend non ha lavorato: gli si restituisce la quota presa con try_acquire()
+                backend.limiter.refund(estimate, requests=1)
+                print(f"🔀 {backend.name} non disponibile ({type(e).__name__}), provo il backend successivo")
+
+    async def _acreate_once(self, backend, messages, stream, estimate, acquire=True, deadline=None):
+        if acquire:
+            waited = await backend.limiter.acquire_async(estimate, deadline)
+            metrics.queue_wait.observe(waited, deployment=backend.deployment)
+        options = dict(self.request_options(messages, stream), model=backend.deployment)
+        if deadline is not None:
+            options["timeout"] = deadline.timeout()
+        start = time.time()
+        try:
+            raw = await backend.async_client.chat.completions.with_raw_response.create(**options)
+        except RateLimitError as e:
+            backend.limiter.throttle(retry_after(e))
+            raise
+
+        backend.limiter.update_from_headers(raw.headers)
+        response = raw.parse()
+        if stream:
+            # Come in _create_once(): il tentativo riesce al primo chunk
+            try:
+                response = _AsyncPrefetched(response, await anext(response, None))
+            except BaseException:
+                await response.close()
+                raise
+        backend.record(time.time() - start)
+        return response
+
+    async def _adiscard(self, response, backend, estimate, start, session_id=None, stream=False):
+        """Come _discard(), chiudendo lo stream senza bloccare l'event loop"""
+        metrics.hedge_discarded.inc(deployment=backend.deployment)
+        if stream:
+            await response.close()
+        elif response.usage:
+            self._account(backend, estimate, response.usage, start, session_id, stream)
+
+    async def _arequest(self, messages, stream, use_cache, deadline=None, session_id=None):
+        tier = self.router.classify(messages) if self.router else None
+        deployment = self.router.deployment(tier) if tier else None
+        start = time.time()
+        try:
+            response, estimate, backend = await self._acreate(messages, stream, deployment, deadline, session_id)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            metrics.errors.inc(error=type(e).__name__)
+            raise
+        usage = None
+        labels = {"deployment": backend.deployment, "stream": "true" if stream else "false"}
+
+        if stream:
+            parts = []
+            try:
+                async for chunk in response:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    # Azure invia anche chunk senza choices (es. filtri sui contenuti)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not parts:
+                            metrics.ttft.observe(time.time() - start, **labels)
+                        parts.append(delta)
+                        yield delta
+            finally:
+                # Se chi legge smette prima della fine, chiudere la connessione ferma la generazione
+                await response.close()
+            answer = "".join(parts)
+        else:
+            usage = response.usage
+            answer = response.choices[0].message.content
+            metrics.ttft.observe(time.time() - start, **labels)
+            yield answer
+
+        metrics.upstream.observe(time.time() - start, **labels)
+        if usage:
+            self._account(backend, estimate, usage, start, session_id, stream)
+        if tier:
+            self.router.record(tier, time.time() - start)
+        self.store_response(messages, answer, use_cache)
+
+    async def _aread(self, stream, cancel=None, deadline=None):
+        """Come _read(), per generatori asincroni"""
+        try:
+            async for delta in stream:
+                yield delta
+                if cancel is not None and cancel.is_set():
+                    raise RequestCancelled("Richiesta annullata")
+                if deadline is not None:
+                    deadline.check()
+        except Exception as e:
+            if deadline is not None and deadline.expired() and not isinstance(e, DeadlineExceeded):
+                raise DeadlineExceeded(str(e)) from e
+            if cancel is not None and cancel.is_set() and not isinstance(e, RequestCancelled):
+                raise RequestCancelled("Richiesta annullata") from e
+            raise
+        finally:
+            await stream.aclose()
+
+    async def aask(self, user_message, history=None, use_cache=True, cancel=None, deadline=None, session_id=None):
+        """Come achat(), ma in caso di errore solleva l'eccezione"""
+        parts = []
+        async for delta in self._achat(user_message, history, use_cache, False, cancel, deadline, session_id):
+            parts.append(delta)
+        return "".join(parts)
+
+    async def achat(self, user_message, history=None, use_cache=True, cancel=None, deadline=None, session_id=None):
+        """Invia un messaggio e attendi la risposta senza bloccare l'event loop"""
+        try:
+            return await self.aask(user_message, history, use_cache, cancel, deadline, session_id)
+        except Exception as e:
+            return f"❌ Errore: {str(e)}"
+
+    async def achat_stream(self, user_message, history=None, use_cache=True, cancel=None, deadline=None,
+                           session_id=None):
+        """Invia un messaggio e ricevi la risposta un pezzo alla volta (async for)"""
+        try:
+            async for delta in self._achat(user_message, history, use_cache, True, cancel, deadline, session_id):
+                yield delta
+        except Exception as e:
+            yield f"❌ Errore: {str(e)}"
+
+    async def achat_many(self, prompts, concurrency=4, use_cache=True, deadline=None, session_id=None):
+        """Invia prompt indipendenti in parallelo, al massimo concurrency alla volta"""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(prompt):
+            item = deadline.copy() if deadline is not None else None
+            async with semaphore:
+                try:
+                    response = await self.aask(prompt, self.new_history(), use_cache, deadline=item,
+                                               session_id=session_id)
+                    return {"response": response, "degraded": bool(item and item.degraded), "error": None}
+                except Exception as e:
+                    return {"response": None, "degraded": False, "error": str(e)}
+
+        # gather() mantiene l'ordine dei prompt
+        results = await asyncio.gather(*(run(p) for p in prompts))
+        if deadline is not None:
+            deadline.degraded = any(r["degraded"] for r in results)
+        return results
+
+    async def _achat(self, user_message, history, use_cache, stream, cancel=None, deadline=None, session_id=None):
+        if history is None:
+            history = self.conversation_history
+
+        self.check_budget(session_id)
+
+        history.append({
+            "role": "user",
+            "content": user_message
+        })
+
+        messages = self.build_messages(history)
+        cached = self.cached_response(messages, use_cache)
+
+        if cached is not None:
+            yield cached
+            self._finish(history, [cached], session_id)
+            return
+
+        # Sempre in streaming: la chiamata si può interrompere e l'hedging vale anche qui
+        parts = []
+        reader = self._aread(self.upstream_async(messages, True, use_cache, deadline, session_id, cancel),
+                             cancel, deadline)
+        try:
+            async for delta in reader:
+                parts.append(delta)
+                yield delta
+        except DeadlineExceeded:
+            # Si completa con la risposta di ripiego quanto già inviato, senza salvarla nella storia
+            sent = "".join(parts)
+            history.pop()
+            yield self.degraded_response(messages, sent, deadline)[len(sent):]
+            return
+        except RequestCancelled:
+            if not stream:
+                # Nessuna risposta da ricordare: si toglie anche la domanda
+                history.pop()
+                raise
+            print("⏹️ Risposta interrotta dall'utente")
+        except (GeneratorExit, asyncio.CancelledError):
+            # Client disconnesso: si ricorda quanto già inviato
+            if stream:
+                self._finish(history, parts, session_id)
+            raise
+        finally:
+            await reader.aclose()
+
+        self._finish(history, parts, session_id)
+
+# Test
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🧪 TEST ASYNC AZURE AI CLIENT")
+    print("=" * 60)
+
+    async def main():
+        client = AsyncAzureAIClient()
+        prompts = ["Ciao! Come ti chiami?", "Puoi aiutarmi con Python?", "Che ore sono a Tokyo?"]
+
+        # Tre conversazioni indipendenti in parallelo
+        results = await client.achat_many(prompts, concurrency=3)
+        for prompt, result in zip(prompts, results):
+            print(f"📤 {prompt}\n📥 {result['response'] or result['error']}\n")
+
+    asyncio.run(main())
@@ -1,64 +1,513 @@
 import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import RateLimitError
+
+try:
+    from .context_window import ContextWindow, PrefixCacheStats
+    from .summarizer import ConversationSummarizer
+    from .response_cache import ResponseCache
+    from .semantic_cache import SemanticCache
+    from .singleflight import SingleFlight
+    from .rate_limiter import retry_after
+    from .backends import BackendPool, FAILOVER_ERRORS
+    from .http_pool import warm_up
+    from .model_router import ModelRouter
+    from .cancellation import RequestCancelled, UpstreamCalls
+    from .deadline import DeadlineExceeded
+    from .metrics import metrics
+    from .usage_ledger import UsageLedger, BudgetExceeded
+except ImportError:
+    from context_window import ContextWindow, PrefixCacheStats
+    from summarizer import ConversationSummarizer
+    from response_cache import ResponseCache
+    from semantic_cache import SemanticCache
+    from singleflight import SingleFlight
+    from rate_limiter import retry_after
+    from backends import BackendPool, FAILOVER_ERRORS
+    from http_pool import warm_up
+    from model_router import ModelRouter
+    from cancellation import RequestCancelled, UpstreamCalls
+    from deadline import DeadlineExceeded
+    from metrics import metrics
+    from usage_ledger import UsageLedger, BudgetExceeded
 
 load_dotenv()
 
+# Testo canonico, senza spazi di indentazione: è l'inizio di ogni prompt e deve restare
+# identico byte per byte tra turni e sessioni perché Azure riusi il prefisso in cache
+SYSTEM_PROMPT = "\n".join((
+    "Sei un assistente AI personale amichevole e utile.",
+    "Il tuo nome è Aiuto. Aiuti l'utente con qualsiasi problema abbia.",
+    "Rispondi in modo conciso e chiaro. Usa un tono amichevole italiano."
+))
+
+
+class _Prefetched:
+    """Stream di cui è già stato letto il primo chunk"""
+
+    def __init__(self, stream, first, calls=None):
+        self.stream = stream
+        self.first = first
+        self.calls = calls
+
+    def __iter__(self):
+        if self.first is not None:
+            yield self.first
+        yield from self.stream
+
+    def close(self):
+        if self.calls is not None:
+            self.calls.detach(self.stream)
+        self.stream.close()
+
+
 class AzureAIClient:
     def __init__(self):
-        self.api_key = os.getenv("AZURE_AI_KEY")
-        self.endpoint = os.getenv("AZURE_AI_ENDPOINT")
-        self.api_version = "2024-12-01-preview"
-        self.deployment = os.getenv("AZURE_AI_MODEL", "gpt-4o-mini")
+        # Uno o più deployment Azure: le richieste vanno al più veloce con quota libera
+        self.pool = BackendPool.from_env()
+        primary = self.pool.primary
+        self.api_key = primary.api_key
+        self.endpoint = primary.endpoint
+        self.api_version = primary.api_version
+        self.deployment = primary.deployment
+        self.temperature = 0.7
+        self.max_tokens = 500
         
-        if not self.api_key or not self.endpoint:
-            raise ValueError("❌ Controlla il file .env! Mancano AZURE_AI_KEY o AZURE_AI_ENDPOINT")
+        for backend in self.pool.backends:
+            print(f"🔗 Connessione a: {backend.endpoint}")
+            print(f"📦 Deployment: {backend.deployment}")
         
-        print(f"🔗 Connessione a: {self.endpoint}")
-        print(f"📦 Deployment: {self.deployment}")
+        self.client = primary.client
         
-        self.client = AzureOpenAI(
-            api_version=self.api_version,
-            azure_endpoint=self.endpoint,
-            api_key=self.api_key
-        )
+        # Connessioni aperte subito, così la prima richiesta non paga DNS e TLS
+        warm_up(self.pool.endpoints)
         
         self.conversation_history = [
             {
                 "role": "system",
-                "content": """Sei un assistente AI personale amichevole e utile.
-                Il tuo nome è Aiuto. Aiuti l'utente con qualsiasi problema abbia.
-                Rispondi in modo conciso e chiaro. Usa un tono amichevole italiano."""
+                "content": SYSTEM_PROMPT
             }
         ]
+        
+        # Limita i token di contesto inviati ad ogni richiesta
+        self.context = ContextWindow(model=self.deployment)
+        self.last_context_report = None
+        
+        # Token del prompt letti dalla cache dei prefissi di Azure
+        self.prefix_cache = PrefixCacheStats()
+        
+        # Riassume i turni più vecchi con un deployment economico
+        self.summarizer = ConversationSummarizer(self.complete, self.context)
+        
+        # Cache delle risposte, attiva solo con AZURE_AI_CACHE=1
+        self.cache = ResponseCache() if os.getenv("AZURE_AI_CACHE") == "1" else None
+        
+        # Cache per prompt simili (parafrasi), attiva solo con AZURE_AI_SEMANTIC_CACHE=1
+        self.semantic_cache = SemanticCache() if os.getenv("AZURE_AI_SEMANTIC_CACHE") == "1" else None
+        
+        # Richieste identiche in contemporanea fanno una sola chiamata upstream (AZURE_AI_COALESCE=0 la disattiva,
+        # ma ogni chiamata gira comunque nel suo thread: chi annulla non aspetta Azure)
+        self.flights = SingleFlight(coalesce=os.getenv("AZURE_AI_COALESCE", "1") == "1")
+        
+        # Quote RPM/TPM, retry e circuit breaker del backend principale
+        # (ogni backend del pool ha i suoi, condivisi da tutti i client del processo)
+        self.limiter = primary.limiter
+        self.resilience = primary.resilience
+        
+        # Richieste semplici al deployment veloce, attivo solo con AZURE_AI_FAST_MODEL
+        self.router = ModelRouter.from_env()
+        
+        # Token usati per sessione/deployment/giorno, disattivabile con AZURE_AI_USAGE_LEDGER=0
+        self.ledger = UsageLedger() if os.getenv("AZURE_AI_USAGE_LEDGER", "1") == "1" else None
     
-    def chat(self, user_message):
-        """Invia un messaggio e ricevi una risposta"""
-        self.conversation_history.append({
+    def new_history(self):
+        """Crea una nuova storia che contiene solo il prompt di sistema"""
+        return [dict(self.conversation_history[0])]
+    
+    def build_messages(self, history):
+        """Sceglie i messaggi da inviare entro il budget di token"""
+        # Un riassunto finito in background entra nella storia qui, mentre chi chiama la ha in uso
+        self.summarizer.apply(history)
+        messages, report = self.context.select(history)
+        self.last_context_report = report
+        if report["dropped_messages"]:
+            print(f"✂️ Contesto ridotto: {report['dropped_messages']} messaggi "
+                  f"({report['dropped_tokens']} token) esclusi")
+        return messages
+    
+    def cached_response(self, messages, use_cache=True):
+        """Cerca una risposta già pronta: prima la cache esatta, poi quella semantica"""
+        if not use_cache:
+            return None
+        
+        answer = None
+        if self.cache:
+            answer = self.cache.get(self.cache.make_key(messages, self.deployment, self.temperature))
+            metrics.cache.inc(cache="exact", result="miss" if answer is None else "hit")
+        if answer is None and self.semantic_cache:
+            namespace = self.semantic_cache.namespace(messages[:-1], self.deployment, self.temperature)
+            answer = self.semantic_cache.lookup(messages[-1]["content"], namespace)
+            metrics.cache.inc(cache="semantic", result="miss" if answer is None else "hit")
+        return answer
+    
+    def store_response(self, messages, answer, use_cache=True):
+        """Salva la risposta nelle cache attive"""
+        if not use_cache:
+            return
+        
+        if self.cache:
+            self.cache.set(self.cache.make_key(messages, self.deployment, self.temperature), answer)
+        if self.semantic_cache:
+            namespace = self.semantic_cache.namespace(messages[:-1], self.deployment, self.temperature)
+            self.semantic_cache.add(messages[-1]["content"], namespace, answer)
+    
+    def request_key(self, messages):
+        """Chiave che identifica richieste upstream identiche"""
+        raw = json.dumps([self.deployment, self.temperature, self.max_tokens, messages],
+                         ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def upstream(self, messages, stream=False, use_cache=True, deadline=None, session_id=None, cancel=None):
+        """Pezzi della risposta di Azure; richieste identiche in corso condividono la chiamata"""
+        # I token di una chiamata condivisa sono addebitati alla sessione che l'ha avviata
+        calls = UpstreamCalls()
+        produce = lambda: self._request(messages, stream, use_cache, deadline, session_id, calls)
+        return self.flights.stream(self.request_key(messages), produce, cancel, calls.abort)
+    
+    def estimate_tokens(self, messages, max_tokens=None):
+        """Token stimati di una richiesta: prompt più il massimo della risposta"""
+        return sum(self.context.count(m) for m in messages) + (max_tokens or self.max_tokens)
+    
+    def request_options(self, messages, stream):
+        """Parametri della chiamata chat.completions"""
+        options = {
+            "messages": messages,
+            "model": self.deployment,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "stream": stream
+        }
+        if stream:
+            # L'ultimo chunk riporta l'uso dei token
+            options["stream_options"] = {"include_usage": True}
+        return options
+    
+    def _create(self, messages, stream, deployment=None, deadline=None, session_id=None, calls=None, overrides=None):
+        """Chiamata ad Azure sul backend migliore, con failover sugli altri"""
+        # overrides cambia i parametri della chiamata (es. temperature, max_tokens)
+        overrides = overrides or {}
+        estimate = self.estimate_tokens(messages, overrides.get("max_tokens"))
+        backends = self.pool.ranked(deployment)
+        start = time.time()
+        for i, backend in enumerate(backends):
+            last = i == len(backends) - 1
+            # Finché ci sono alternative: niente attesa di quota e un solo tentativo
+            if not last and not backend.limiter.try_acquire(estimate):
+                continue
+            try:
+                # Gli stream tornano dopo il primo chunk: l'hedging copre il tempo alla prima parola
+                response = backend.resilience.call(
+                    lambda: self._create_once(backend, messages, stream, estimate, last, deadline, calls, overrides),
+                    hedge=stream, attempts=None if last else 1, deadline=deadline,
+                    on_discard=lambda loser, backend=backend: self._discard(loser, backend, estimate, start,
+                                                                            session_id, stream),
+                    calls=calls
+                )
+                return response, estimate, backend
+            except FAILOVER_ERRORS as e:
+                if last:
+                    raise
+                # Il backend non ha lavorato: gli si restituisce la quota presa con try_acquire()
+                backend.limiter.refund(estimate, requests=1)
+                print(f"🔀 {backend.name} non disponibile ({type(e).__name__}), provo il backend successivo")
+    
+    def _create_once(self, backend, messages, stream, estimate, acquire=True, deadline=None, calls=None,
+                     overrides=None):
+        """Un singolo tentativo su un backend, dopo aver atteso la quota"""
+        cancel = calls.cancel if calls is not None else None
+        if cancel is not None and cancel.is_set():
+            raise RequestCancelled("Richiesta annullata")
+        if acquire:
+            waited = backend.limiter.acquire(estimate, deadline, cancel)
+            metrics.queue_wait.observe(waited, deployment=backend.deployment)
+        options = dict(self.request_options(messages, stream), **(overrides or {}), model=backend.deployment)
+        if deadline is not None:
+            # Connessione e lettura non possono andare oltre il tempo rimasto
+            options["timeout"] = deadline.timeout()
+        start = time.time()
+        try:
+            raw = backend.client.chat.completions.with_raw_response.create(**options)
+        except RateLimitError as e:
+            backend.limiter.throttle(retry_after(e))
+            raise
+        
+        backend.limiter.update_from_headers(raw.headers)
+        response = raw.parse()
+        if stream:
+            response = self._prefetch(response, calls)
+        backend.record(time.time() - start)
+        return response
+    
+    def _prefetch(self, response, calls=None):
+        """Legge il primo chunk dello stream; calls.abort() può interrompere la lettura da un altro thread"""
+        if calls is not None:
+            calls.attach(response)
+        try:
+            return _Prefetched(response, next(response, None), calls)
+        except BaseException as e:
+            if calls is not None:
+                calls.detach(response)
+            response.close()
+            if calls is not None and calls.cancel.is_set():
+                raise RequestCancelled("Richiesta annullata") from e
+            raise
+    
+    def _account(self, backend, estimate, usage, start, session_id=None, stream=False):
+        """Restituisce la quota stimata in più e registra i token in metriche e registro"""
+        backend.limiter.refund(estimate - usage.total_tokens)
+        metrics.record_usage(backend.deployment, usage)
+        self.prefix_cache.record(usage)
+        if self.ledger:
+            self.ledger.record(session_id, backend.deployment, usage, time.time() - start, stream)
+    
+    def _discard(self, response, backend, estimate, start, session_id=None, stream=False):
+        """Risposta di una richiesta hedged arrivata seconda: si chiude e se ne contano i token"""
+        # Di uno stream chiuso al primo chunk l'uso reale non si conosce: resta addebitata la quota stimata
+        metrics.hedge_discarded.inc(deployment=backend.deployment)
+        close = getattr(response, "close", None)
+        if close is not None:
+            close()
+        usage = getattr(response, "usage", None)
+        if usage:
+            self._account(backend, estimate, usage, start, session_id, stream)
+    
+    def complete(self, messages, deployment=None, session_id=None, **overrides):
+        """Risposta completa, non in streaming, per le chiamate interne (es. riassunti)"""
+        # Stessa strada delle chat: quota, retry, circuit breaker, failover, metriche e registro dei token
+        start = time.time()
+        try:
+            response, estimate, backend = self._create(messages, False, deployment, session_id=session_id,
+                                                       overrides=overrides)
+        except Exception as e:
+            metrics.errors.inc(error=type(e).__name__)
+            raise
+        metrics.upstream.observe(time.time() - start, deployment=backend.deployment, stream="false")
+        if response.usage:
+            self._account(backend, estimate, response.usage, start, session_id)
+        return response.choices[0].message.content
+    
+    def check_budget(self, session_id=None):
+        """Solleva BudgetExceeded se la sessione ha finito i token di oggi"""
+        if self.ledger:
+            self.ledger.check_budget(session_id)
+    
+    def _request(self, messages, stream, use_cache, deadline=None, session_id=None, calls=None):
+        tier = self.router.classify(messages) if self.router else None
+        deployment = self.router.deployment(tier) if tier else None
+        start = time.time()
+        try:
+            response, estimate, backend = self._create(messages, stream, deployment, deadline, session_id, calls)
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            metrics.errors.inc(error=type(e).__name__)
+            raise
+        usage = None
+        labels = {"deployment": backend.deployment, "stream": "true" if stream else "false"}
+        
+        if stream:
+            parts = []
+            try:
+                for chunk in response:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    # Azure invia anche chunk senza choices (es. filtri sui contenuti)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not parts:
+                            metrics.ttft.observe(time.time() - start, **labels)
+                        parts.append(delta)
+                        yield delta
+            finally:
+                # Se chi legge smette prima della fine, chiudere la connessione ferma la generazione
+                response.close()
+            answer = "".join(parts)
+        else:
+            usage = response.usage
+            answer = response.choices[0].message.content
+            metrics.ttft.observe(time.time() - start, **labels)
+            yield answer
+        
+        metrics.upstream.observe(time.time() - start, **labels)
+        if usage:
+            self._account(backend, estimate, usage, start, session_id, stream)
+        if tier:
+            self.router.record(tier, time.time() - start)
+        self.store_response(messages, answer, use_cache)
+    
+    def _read(self, stream, cancel=None, deadline=None):
+        """Pezzi di stream finché non si annulla o scade il tempo; poi chiude la chiamata upstream"""
+        try:
+            for delta in stream:
+                yield delta
+                if cancel is not None and cancel.is_set():
+                    raise RequestCancelled("Richiesta annullata")
+                if deadline is not None:
+                    deadline.check()
+        except Exception as e:
+            # Un timeout di rete a tempo scaduto è la scadenza della richiesta
+            if deadline is not None and deadline.expired() and not isinstance(e, DeadlineExceeded):
+                raise DeadlineExceeded(str(e)) from e
+            if cancel is not None and cancel.is_set() and not isinstance(e, RequestCancelled):
+                raise RequestCancelled("Richiesta annullata") from e
+            raise
+        finally:
+            stream.close()
+    
+    def degraded_response(self, messages, partial="", deadline=None):
+        """Risposta di ripiego a tempo scaduto: la parte già generata o una risposta simile in cache"""
+        if deadline is not None:
+            deadline.degraded = True
+        if partial:
+            return partial + " …"
+        if self.semantic_cache:
+            # Stessa soglia e stesse parole chiave di un hit normale: mai la risposta a un'altra domanda
+            namespace = self.semantic_cache.namespace(messages[:-1], self.deployment, self.temperature)
+            answer = self.semantic_cache.lookup(messages[-1]["content"], namespace)
+            if answer is not None:
+                return answer
+        return "⏱️ Non sono riuscito a rispondere in tempo, riprova tra poco."
+    
+    def _finish(self, history, parts, session_id=None):
+        """Aggiunge la risposta (anche parziale) alla storia"""
+        history.append({
+            "role": "assistant",
+            "content": "".join(parts)
+        })
+        self.summarizer.maybe_summarize(history, session_id)
+    
+    def ask(self, user_message, history=None, use_cache=True, cancel=None, deadline=None, session_id=None):
+        """Come chat(), ma in caso di errore solleva l'eccezione"""
+        if history is None:
+            history = self.conversation_history
+        
+        self.check_budget(session_id)
+        
+        history.append({
             "role": "user",
             "content": user_message
         })
         
-        try:
-            response = self.client.chat.completions.create(
-                messages=self.conversation_history,
-                model=self.deployment,
-                temperature=0.7,
-                max_tokens=500
-            )
-            
-            assistant_message = response.choices[0].message.content
-            
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": assistant_message
-            })
-            
-            return assistant_message
+        messages = self.build_messages(history)
+        assistant_message = self.cached_response(messages, use_cache)
+        
+        if assistant_message is None:
+            # Sempre in streaming: la chiamata si può interrompere e l'hedging vale anche qui
+            parts = []
+            reader = self._read(self.upstream(messages, True, use_cache, deadline, session_id, cancel), cancel, deadline)
+            try:
+                for delta in reader:
+                    parts.append(delta)
+                assistant_message = "".join(parts)
+            except RequestCancelled:
+                # Nessuna risposta da ricordare: si toglie anche la domanda
+                history.pop()
+                raise
+            except DeadlineExceeded:
+                # La risposta di ripiego va a chi chiama ma non nella storia: si toglie anche la domanda
+                history.pop()
+                return self.degraded_response(messages, "".join(parts), deadline)
+            finally:
+                reader.close()
+        
+        self._finish(history, [assistant_message], session_id)
         
+        return assistant_message
+    
+    def chat(self, user_message, history=None, use_cache=True, cancel=None, deadline=None, session_id=None):
+        """Invia un messaggio e ricevi una risposta"""
+        try:
+            return self.ask(user_message, history, use_cache, cancel, deadline, session_id)
         except Exception as e:
             return f"❌ Errore: {str(e)}"
     
+    def chat_many(self, prompts, concurrency=4, use_cache=True, deadline=None, session_id=None):
+        """Invia prompt indipendenti in parallelo, al massimo concurrency alla volta"""
+        def run(prompt):
+            # Ogni prompt è una conversazione a sé: un errore non tocca gli altri
+            item = deadline.copy() if deadline is not None else None
+            try:
+                response = self.ask(prompt, self.new_history(), use_cache, deadline=item, session_id=session_id)
+                return {"response": response, "degraded": bool(item and item.degraded), "error": None}
+            except Exception as e:
+                return {"response": None, "degraded": False, "error": str(e)}
+        
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="chat_many") as pool:
+            # map() mantiene l'ordine dei prompt
+            results = list(pool.map(run, prompts))
+        if deadline is not None:
+            deadline.degraded = any(r["degraded"] for r in results)
+        return results
+
+    def chat_stream(self, user_message, history=None, use_cache=True, cancel=None, deadline=None, session_id=None):
+        """Invia un messaggio e ricevi la risposta un pezzo alla volta"""
+        if history is None:
+            history = self.conversation_history
+
+        try:
+            self.check_budget(session_id)
+        except BudgetExceeded as e:
+            yield f"❌ Errore: {str(e)}"
+            return
+
+        history.append({
+            "role": "user",
+            "content": user_message
+        })
+
+        parts = []
+        reader = None
+        try:
+            messages = self.build_messages(history)
+            cached = self.cached_response(messages, use_cache)
+
+            if cached is not None:
+                parts.append(cached)
+                yield cached
+            else:
+                reader = self._read(self.upstream(messages, True, use_cache, deadline, session_id, cancel),
+                                    cancel, deadline)
+                for delta in reader:
+                    parts.append(delta)
+                    yield delta
+
+        except RequestCancelled:
+            print("⏹️ Risposta interrotta dall'utente")
+        except DeadlineExceeded:
+            # Si completa con la risposta di ripiego quanto già inviato, senza salvarla nella storia
+            sent = "".join(parts)
+            history.pop()
+            yield self.degraded_response(messages, sent, deadline)[len(sent):]
+            return
+        except GeneratorExit:
+            # Client disconnesso: si ricorda quanto già inviato
+            self._finish(history, parts, session_id)
+            raise
+        except Exception as e:
+            yield f"❌ Errore: {str(e)}"
+            return
+        finally:
+            if reader is not None:
+                reader.close()
+
+        self._finish(history, parts, session_id)
+
     def reset_conversation(self):
         """Reset della conversazione"""
         self.conversation_history = self.conversation_history[:1]
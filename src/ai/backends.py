@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import threading
+from openai import AzureOpenAI, AsyncAzureOpenAI
+
+try:
+    from .rate_limiter import get_limiter
+    from .resilience import get_resilience, CircuitOpenError, TRANSIENT_ERRORS
+    from .http_pool import get_http_client, get_async_http_client
+except ImportError:
+    from rate_limiter import get_limiter
+    from resilience import get_resilience, CircuitOpenError, TRANSIENT_ERRORS
+    from http_pool import get_http_client, get_async_http_client
+
+API_VERSION = "2024-12-01-preview"
+
+# Errori per cui si passa al backend successivo
+FAILOVER_ERRORS = TRANSIENT_ERRORS + (CircuitOpenError,)
+
+
+class Backend:
+    """Un endpoint/deployment Azure con le sue quote, la sua latenza e il suo circuito"""
+
+    def __init__(self, name, endpoint, api_key, deployment, api_version=API_VERSION):
+        self.name = name
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.deployment = deployment
+        self.api_version = api_version
+
+        self.client = AzureOpenAI(
+            api_version=api_version,
+            azure_endpoint=endpoint,
+            api_key=api_key,
+            # I retry sono gestiti da Resilience
+            max_retries=0,
+            # Connessioni condivise con tutti gli altri client del processo
+            http_client=get_http_client()
+        )
+        self._async_client = None
+
+        self.limiter = get_limiter(endpoint, deployment)
+        self.resilience = get_resilience(endpoint, deployment)
+        self.latency = None
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def async_client(self):
+        """Client asincrono, creato solo se serve"""
+        if self._async_client is None:
+            self._async_client = AsyncAzureOpenAI(
+                api_version=self.api_version,
+                azure_endpoint=self.endpoint,
+                api_key=self.api_key,
+                max_retries=0,
+                http_client=get_async_http_client()
+            )
+        return self._async_client
+
+    def record(self, seconds):
+        """Aggiorna la media mobile esponenziale della latenza"""
+        with self.lock:
+            self.requests += 1
+            self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+
+    def quota_left(self, snapshot=None):
+        """Frazione di quota residua ad ora, ricarica compresa (1.0 se non ci sono limiti noti)"""
+        snapshot = snapshot or self.limiter.snapshot()
+        fractions = [
+            snapshot[kind] / limit
+            for kind, limit in self.limiter.limits.items() if limit
+        ]
+        return max(0.0, min(fractions)) if fractions else 1.0
+
+    def score(self):
+        """Costo stimato di una richiesta: più basso è meglio"""
+        snapshot = self.limiter.snapshot()
+        if self.resilience.breaker.state == "open" or snapshot["blocked_until"] > time.time():
+            return float("inf")
+        # Senza misure si parte da un valore neutro, così ogni backend viene provato
+        latency = self.latency if self.latency is not None else 1.0
+        return latency / max(0.05, self.quota_left(snapshot))
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "deployment": self.deployment,
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "requests": self.requests,
+            "quota_left": round(self.quota_left(), 3),
+            "rate_limit": self.limiter.stats(),
+            "resilience": self.resilience.stats()
+        }
+
+
+class BackendPool:
+    """Insieme di backend Azure: le richieste vanno a quello più veloce con quota libera"""
+
+    def __init__(self, backends):
+        if not backends:
+            raise ValueError("❌ Nessun backend Azure configurato")
+        self.backends = backends
+        # Backend creati al volo per deployment non configurati (es. il modello veloce)
+        self.derived = []
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Backend da AZURE_AI_FAKE_URL, AZURE_AI_BACKENDS (JSON) o AZURE_AI_BACKENDS_FILE, altrimenti da AZURE_AI_ENDPOINT"""
+        # Server finto locale (src/bench/fake_azure.py): nessuna credenziale né rete
+        fake = os.getenv("AZURE_AI_FAKE_URL")
+        if fake:
+            return cls([Backend("fake", fake, "fake-key", os.getenv("AZURE_AI_MODEL", "gpt-4o-mini"))])
+
+        config = os.getenv("AZURE_AI_BACKENDS")
+        path = os.getenv("AZURE_AI_BACKENDS_FILE")
+        if not config and path:
+            with open(path, "r", encoding="utf-8") as f:
+                config = f.read()
+
+        if not config:
+            api_key = os.getenv("AZURE_AI_KEY")
+            endpoint = os.getenv("AZURE_AI_ENDPOINT")
+            if not api_key or not endpoint:
+                raise ValueError("❌ Controlla il file .env! Mancano AZURE_AI_KEY o AZURE_AI_ENDPOINT")
+            return cls([Backend("default", endpoint, api_key, os.getenv("AZURE_AI_MODEL", "gpt-4o-mini"))])
+
+        backends = []
+        for i, entry in enumerate(json.loads(config)):
+            # La chiave può stare in una variabile d'ambiente invece che nel file
+            api_key = entry.get("api_key") or os.getenv(entry.get("api_key_env", "AZURE_AI_KEY"))
+            backends.append(Backend(
+                entry.get("name", f"backend-{i}"),
+                entry["endpoint"],
+                api_key,
+                entry.get("deployment", os.getenv("AZURE_AI_MODEL", "gpt-4o-mini")),
+                entry.get("api_version", API_VERSION)
+            ))
+        return cls(backends)
+
+    @property
+    def primary(self):
+        return self.backends[0]
+
+    def ranked(self, deployment=None):
+        """Backend in ordine di preferenza; quelli non disponibili in fondo"""
+        backends = self.backends if deployment is None else self.for_deployment(deployment)
+        return sorted(backends, key=lambda b: (b.score(), b.requests))
+
+    def for_deployment(self, deployment):
+        """Backend di un deployment; se nessuno è configurato si usano gli stessi endpoint"""
+        with self.lock:
+            matching = [b for b in self.backends + self.derived if b.deployment == deployment]
+            if not matching:
+                seen = set()
+                for b in self.backends:
+                    if b.endpoint in seen:
+                        continue
+                    seen.add(b.endpoint)
+                    matching.append(Backend(f"{b.name}/{deployment}", b.endpoint, b.api_key, deployment, b.api_version))
+                self.derived.extend(matching)
+            return matching
+
+    @property
+    def endpoints(self):
+        return sorted({b.endpoint for b in self.backends})
+
+    def stats(self):
+        return [b.stats() for b in self.backends + self.derived]
@@ -0,0 +1,130 @@
+import socket
+import threading
+from contextlib import contextmanager
+
+
+class RequestCancelled(Exception):
+    """La richiesta è stata annullata (stop dell'utente o client disconnesso)"""
+
+
+class CancelToken(threading.Event):
+    """Evento di annullamento che avvisa subito chi è in attesa: le callback girano dentro set()"""
+
+    def __init__(self):
+        super().__init__()
+        self.callbacks = []
+        self.callbacks_lock = threading.Lock()
+
+    def set(self):
+        super().set()
+        with self.callbacks_lock:
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def subscribe(self, callback):
+        """Chiama callback all'annullamento (subito se è già avvenuto); ritorna la funzione che la toglie"""
+        with self.callbacks_lock:
+            if not self.is_set():
+                self.callbacks.append(callback)
+                return lambda: self._unsubscribe(callback)
+        callback()
+        return lambda: None
+
+    def _unsubscribe(self, callback):
+        with self.callbacks_lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+
+def shutdown_response(response):
+    """Interrompe una risposta in streaming, anche se un altro thread è fermo a leggerla"""
+    # close() da un altro thread non sveglia una recv() in corso: shutdown() del socket sì
+    http = getattr(response, "response", response)
+    network = getattr(http, "extensions", {}).get("network_stream")
+    sock = network.get_extra_info("socket") if network is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class UpstreamCalls:
+    """Risposte upstream aperte per una richiesta; abort() le interrompe da qualsiasi thread"""
+
+    def __init__(self):
+        self.cancel = threading.Event()
+        # risposta -> thread che l'ha aperta; thread il cui tentativo non serve più (hedging)
+        self.responses = {}
+        self.interrupted = set()
+        self.lock = threading.Lock()
+
+    def attach(self, response):
+        """Registra una risposta appena aperta; se la richiesta è già annullata la chiude subito"""
+        thread = threading.get_ident()
+        with self.lock:
+            if not self.cancel.is_set() and thread not in self.interrupted:
+                self.responses[response] = thread
+                return
+        response.close()
+        raise RequestCancelled("Richiesta annullata")
+
+    def detach(self, response):
+        # Dopo detach() il socket può tornare nel pool: abort() non deve più toccarlo
+        with self.lock:
+            self.responses.pop(response, None)
+
+    def abort(self):
+        with self.lock:
+            self.cancel.set()
+            for response in self.responses:
+                shutdown_response(response)
+
+    def interrupt(self, thread):
+        """Interrompe solo il tentativo in corso nel thread indicato (es. la richiesta hedged che ha perso)"""
+        with self.lock:
+            self.interrupted.add(thread)
+            for response, owner in self.responses.items():
+                if owner == thread:
+                    shutdown_response(response)
+
+    def resume(self, thread):
+        with self.lock:
+            self.interrupted.discard(thread)
+
+
+class CancelRegistry:
+    """Richieste in corso per sessione, annullabili da un'altra richiesta HTTP"""
+
+    def __init__(self):
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def track(self, key):
+        """Registra una richiesta in corso e ritorna l'evento che la annulla"""
+        cancel = CancelToken()
+        with self.lock:
+            self.requests.setdefault(key, []).append(cancel)
+        try:
+            yield cancel
+        finally:
+            with self.lock:
+                pending = self.requests.get(key, [])
+                if cancel in pending:
+                    pending.remove(cancel)
+                if not pending:
+                    self.requests.pop(key, None)
+
+    def cancel(self, key):
+        """Annulla tutte le richieste in corso di key; ritorna quante erano"""
+        with self.lock:
+            pending = list(self.requests.get(key, []))
+        for cancel in pending:
+            cancel.set()
+        return len(pending)
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": sum(len(p) for p in self.requests.values())}
@@ -0,0 +1,123 @@
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import tiktoken
+except ImportError:
+    # Senza tiktoken si usa una stima basata sulla lunghezza del testo
+    tiktoken = None
+
+# Token fissi che l'API aggiunge per ogni messaggio (ruolo e separatori)
+MESSAGE_OVERHEAD = 4
+
+
+class ContextWindow:
+    """Sceglie quali messaggi della storia inviare restando entro un budget di token"""
+
+    def __init__(self, max_tokens=None, model="gpt-4o-mini", cache_size=20000, trim_chunk=None):
+        self.max_tokens = max_tokens or int(os.getenv("AZURE_AI_CONTEXT_TOKENS", 3000))
+        # I turni vecchi si tolgono a blocchi di trim_chunk messaggi (1 = uno alla volta)
+        self.trim_chunk = max(1, trim_chunk or int(os.getenv("AZURE_AI_CONTEXT_TRIM_CHUNK", 8)))
+        self.cache_size = cache_size
+        self.counts = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.encoder = None
+        if tiktoken is not None:
+            try:
+                self.encoder = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoder = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # tiktoken scarica la codifica al primo uso: offline si usa la stima
+                print(f"⚠️ Tokenizer non disponibile, uso una stima: {e}")
+
+    def count(self, message):
+        """Token di un messaggio, calcolati una sola volta e poi presi dalla cache"""
+        key = (message["role"], message.get("content") or "")
+
+        with self.lock:
+            tokens = self.counts.get(key)
+            if tokens is not None:
+                self.counts.move_to_end(key)
+                return tokens
+
+        text = key[1]
+        if self.encoder is not None:
+            tokens = len(self.encoder.encode(text)) + MESSAGE_OVERHEAD
+        else:
+            tokens = len(text) // 3 + 1 + MESSAGE_OVERHEAD
+
+        with self.lock:
+            self.counts[key] = tokens
+            if len(self.counts) > self.cache_size:
+                self.counts.popitem(last=False)
+        return tokens
+
+    def select(self, history):
+        """Ritorna il prompt di sistema più i turni più recenti che stanno nel budget"""
+        # I messaggi di sistema iniziali (prompt e riassunto) vengono sempre inviati
+        pinned = 1
+        while pinned < len(history) and history[pinned]["role"] == "system":
+            pinned += 1
+        system, turns = history[:pinned], history[pinned:]
+        budget = self.max_tokens - sum(self.count(m) for m in system)
+
+        kept = []
+        used = 0
+        for message in reversed(turns):
+            tokens = self.count(message)
+            # L'ultimo messaggio viene sempre inviato, anche se da solo supera il budget
+            if kept and used + tokens > budget:
+                break
+            kept.append(message)
+            used += tokens
+        kept.reverse()
+
+        drop = len(turns) - len(kept)
+        aligned = -(-drop // self.trim_chunk) * self.trim_chunk
+        # Tagliando a multipli fissi l'inizio del contesto resta identico per più turni,
+        # così Azure può riusare il prefisso del prompt già in cache; se il blocco è troppo
+        # grande rispetto al budget si taglia il minimo, per non perdere metà del contesto
+        if drop and aligned != drop and len(turns) - aligned >= max(1, len(kept) // 2):
+            kept = turns[aligned:]
+            used = sum(self.count(m) for m in kept)
+
+        # Non iniziare il contesto con una risposta senza la sua domanda
+        while len(kept) > 1 and kept[0]["role"] == "assistant":
+            used -= self.count(kept.pop(0))
+
+        dropped = turns[:len(turns) - len(kept)]
+        report = {
+            "sent_messages": len(system) + len(kept),
+            "sent_tokens": self.max_tokens - budget + used,
+            "dropped_messages": len(dropped),
+            "dropped_tokens": sum(self.count(m) for m in dropped)
+        }
+        return system + kept, report
+
+
+class PrefixCacheStats:
+    """Quanta parte dei prompt Azure ha letto dalla cache dei prefissi (usage.prompt_tokens_details)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "hits": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+    def record(self, usage):
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        with self.lock:
+            self.counters["requests"] += 1
+            self.counters["hits"] += 1 if cached else 0
+            self.counters["prompt_tokens"] += usage.prompt_tokens
+            self.counters["cached_tokens"] += cached
+        return cached
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["hit_rate"] = round(stats["hits"] / stats["requests"], 3) if stats["requests"] else 0.0
+        stats["cached_ratio"] = round(stats["cached_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else 0.0
+        return stats
@@ -0,0 +1,38 @@
+import time
+
+
+class DeadlineExceeded(TimeoutError):
+    """Il budget di tempo della richiesta è esaurito"""
+
+
+class Deadline:
+    """Budget di tempo di una richiesta, condiviso da attese di quota, retry e streaming"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+        # Impostato dal client se la risposta è di ripiego (parziale o dalla cache)
+        self.degraded = False
+
+    def copy(self):
+        """Stessa scadenza ma flag degraded proprio, per ogni richiesta di un batch"""
+        deadline = Deadline(self.seconds)
+        deadline.expires = self.expires
+        return deadline
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        """Solleva DeadlineExceeded se il budget è esaurito"""
+        if self.expired():
+            raise DeadlineExceeded(f"Tempo esaurito ({self.seconds:g}s)")
+
+    def timeout(self, cap=None):
+        """Timeout da usare per la prossima operazione: il tempo rimasto, al massimo cap"""
+        self.check()
+        remaining = self.remaining()
+        return min(remaining, cap) if cap else remaining
@@ -0,0 +1,127 @@
+import os
+import asyncio
+import threading
+import httpx
+
+_client = None
+_async_client = None
+_lock = threading.Lock()
+_warmed = set()
+_pinger = None
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=int(os.getenv("AZURE_AI_HTTP_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(os.getenv("AZURE_AI_HTTP_KEEPALIVE_CONNECTIONS", 20)),
+        keepalive_expiry=float(os.getenv("AZURE_AI_HTTP_KEEPALIVE_EXPIRY", 300))
+    )
+
+
+def _timeout():
+    return httpx.Timeout(float(os.getenv("AZURE_AI_HTTP_TIMEOUT", 60)), connect=10.0)
+
+
+def get_http_client():
+    """Client HTTP condiviso da tutti i client Azure del processo (connessioni riusate)"""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = httpx.Client(limits=_limits(), timeout=_timeout())
+        return _client
+
+
+def get_async_http_client():
+    """Come get_http_client(), per i client asincroni"""
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            _async_client = httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+        return _async_client
+
+
+def warm_up(endpoints):
+    """Apre in background le connessioni verso gli endpoint (DNS, TLS) e le tiene vive"""
+    if os.getenv("AZURE_AI_HTTP_WARMUP", "1") != "1":
+        return
+    with _lock:
+        new = [e for e in endpoints if e not in _warmed]
+        _warmed.update(new)
+    if new:
+        threading.Thread(target=_open, args=(new,), name="http-warmup", daemon=True).start()
+    _start_pinger()
+
+
+async def warm_up_async(endpoints):
+    """Apre le connessioni del client asincrono; da chiamare dentro l'event loop dell'app"""
+    if os.getenv("AZURE_AI_HTTP_WARMUP", "1") != "1":
+        return
+    client = get_async_http_client()
+    count = int(os.getenv("AZURE_AI_HTTP_WARM_CONNECTIONS", 2))
+    await asyncio.gather(*(_aping(client, e) for e in endpoints for _ in range(count)))
+
+
+async def keep_alive_async(endpoints):
+    """Tiene vive le connessioni del client asincrono mentre l'app è inattiva"""
+    interval = float(os.getenv("AZURE_AI_HTTP_PING_INTERVAL", 60))
+    if interval <= 0:
+        return
+    client = get_async_http_client()
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.gather(*(_aping(client, e) for e in endpoints))
+
+
+def stats():
+    """Connessioni aperte nel pool sincrono"""
+    pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", [])
+    return {
+        "connections": len(connections),
+        "idle": sum(1 for c in connections if c.is_idle()),
+        "warmed_endpoints": len(_warmed)
+    }
+
+
+def _open(endpoints):
+    # Più richieste in parallelo aprono più connessioni, pronte per richieste concorrenti
+    count = int(os.getenv("AZURE_AI_HTTP_WARM_CONNECTIONS", 2))
+    threads = [threading.Thread(target=_ping, args=(e,), daemon=True) for e in endpoints for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"🔥 Connessioni pronte verso {len(endpoints)} endpoint")
+
+
+def _ping(endpoint):
+    # Qualsiasi risposta (anche 404) lascia la connessione aperta nel pool
+    try:
+        get_http_client().get(endpoint, timeout=10)
+    except httpx.HTTPError:
+        pass
+
+
+async def _aping(client, endpoint):
+    try:
+        await client.get(endpoint, timeout=10)
+    except httpx.HTTPError:
+        pass
+
+
+def _start_pinger():
+    global _pinger
+    interval = float(os.getenv("AZURE_AI_HTTP_PING_INTERVAL", 60))
+    with _lock:
+        if _pinger is not None or interval <= 0:
+            return
+        _pinger = threading.Thread(target=_ping_loop, args=(interval,), name="http-keepalive", daemon=True)
+    _pinger.start()
+
+
+def _ping_loop(interval):
+    # Gli endpoint chiudono le connessioni inattive: un ping periodico le tiene aperte
+    event = threading.Event()
+    while not event.wait(interval):
+        for endpoint in list(_warmed):
+            _ping(endpoint)
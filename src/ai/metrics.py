@@ -0,0 +1,178 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Secondi: dalle risposte in cache (ms) alle generazioni lunghe
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values]
+
+
+class Counter(_Metric):
+    """Valore che cresce soltanto (richieste, token, errori)"""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Valore istantaneo; con set_function viene letto al momento dello scrape"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.function = None
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def _samples(self):
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception:
+                pass
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    """Distribuzione di durate in bucket cumulativi, come gli istogrammi Prometheus"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Conteggi per bucket (l'ultimo è +Inf), somma
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self.lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """Metriche del processo in formato testo Prometheus (un registro per worker)"""
+
+    def __init__(self):
+        self.registry = []
+
+        # Web
+        self.http_request = self._add(Histogram(
+            "http_request_duration_seconds", "Durata delle richieste HTTP (fino agli header per lo streaming)",
+            ("route", "method", "status")))
+        self.sessions = self._add(Gauge("sessions_active", "Sessioni di chat in memoria"))
+
+        # Client AI
+        self.queue_wait = self._add(Histogram(
+            "ai_queue_wait_seconds", "Attesa in coda per la quota RPM/TPM", ("deployment",)))
+        self.ttft = self._add(Histogram(
+            "ai_upstream_ttft_seconds", "Tempo fino al primo token da Azure", ("deployment", "stream")))
+        self.upstream = self._add(Histogram(
+            "ai_upstream_duration_seconds", "Durata totale delle chiamate ad Azure", ("deployment", "stream")))
+        self.tokens = self._add(Counter(
+            "ai_tokens_total", "Token riportati da usage (prompt, completion, cached)", ("deployment", "kind")))
+        self.cache = self._add(Counter(
+            "ai_cache_requests_total", "Ricerche nelle cache delle risposte", ("cache", "result")))
+        self.errors = self._add(Counter(
+            "ai_errors_total", "Errori delle chiamate ad Azure per classe", ("error",)))
+        self.hedge_discarded = self._add(Counter(
+            "ai_hedge_discarded_total", "Risposte hedged arrivate seconde e scartate", ("deployment",)))
+
+        # Avatar
+        self.avatar_state = self._add(Counter(
+            "avatar_state_changes_total", "Cambi di stato dell'avatar", ("state",)))
+        self.avatar_render = self._add(Histogram(
+            "avatar_render_seconds", "Tempo per preparare un frame dell'avatar", ("size",),
+            buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)))
+
+    def _add(self, metric):
+        self.registry.append(metric)
+        return metric
+
+    def record_usage(self, deployment, usage):
+        """Conta i token di un oggetto usage dell'API"""
+        self.tokens.inc(usage.prompt_tokens, deployment=deployment, kind="prompt")
+        self.tokens.inc(usage.completion_tokens, deployment=deployment, kind="completion")
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or 0
+        if cached:
+            self.tokens.inc(cached, deployment=deployment, kind="cached")
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.registry) + "\n"
+
+
+# Registro condiviso da tutto il processo
+metrics = Metrics()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,84 @@
+import os
+import re
+import threading
+
+try:
+    from .resilience import LatencyTracker
+except ImportError:
+    from resilience import LatencyTracker
+
+# Parole che indicano una richiesta che merita il modello più capace
+HARD_KEYWORDS = (
+    "codice", "python", "programma", "funzione", "script", "errore", "bug", "debug",
+    "spiega", "perché", "perchè", "analizza", "confronta", "differenza", "scrivi",
+    "calcola", "traduci", "riassumi", "pianifica", "strategia", "dimostra", "ottimizza",
+    "come faccio", "passo passo"
+)
+
+# Saluti e conferme: bastano al modello veloce anche a conversazione avanzata
+SMALL_TALK = re.compile(
+    r"^(ciao|salve|buongiorno|buonasera|buonanotte|hey|ehi|grazie|ok|okay|perfetto|"
+    r"va bene|d'accordo|bene|benissimo|ottimo|sì|si|no|come stai|a presto)\b"
+)
+
+
+class ModelRouter:
+    """Manda le richieste semplici a un deployment veloce e quelle difficili a uno più capace"""
+
+    def __init__(self, fast_deployment, strong_deployment=None, max_fast_chars=None, max_fast_turns=None):
+        # strong_deployment None: i backend configurati nel pool
+        self.deployments = {"fast": fast_deployment, "strong": strong_deployment}
+        self.max_fast_chars = max_fast_chars or int(os.getenv("AZURE_AI_FAST_MAX_CHARS", 160))
+        self.max_fast_turns = max_fast_turns or int(os.getenv("AZURE_AI_FAST_MAX_TURNS", 6))
+
+        self.latency = {tier: LatencyTracker() for tier in self.deployments}
+        self.counts = {tier: 0 for tier in self.deployments}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Router attivo solo se è configurato AZURE_AI_FAST_MODEL"""
+        fast = os.getenv("AZURE_AI_FAST_MODEL")
+        if not fast:
+            return None
+        return cls(fast, os.getenv("AZURE_AI_STRONG_MODEL"))
+
+    def classify(self, messages):
+        """Ritorna 'fast' o 'strong' in base all'ultimo messaggio e alla profondità della storia"""
+        text = messages[-1]["content"].strip().lower()
+        depth = sum(1 for m in messages if m["role"] == "user")
+
+        if "```" in text or len(text) > self.max_fast_chars:
+            return "strong"
+        if any(keyword in text for keyword in HARD_KEYWORDS):
+            return "strong"
+        # Più domande nello stesso messaggio
+        if text.count("?") > 1:
+            return "strong"
+        if SMALL_TALK.match(text):
+            return "fast"
+        # A conversazione avanzata la risposta dipende da molto contesto
+        return "strong" if depth > self.max_fast_turns else "fast"
+
+    def deployment(self, tier):
+        return self.deployments[tier]
+
+    def record(self, tier, seconds):
+        """Registra la durata di una richiesta servita dal livello tier"""
+        self.latency[tier].add(seconds)
+        with self.lock:
+            self.counts[tier] += 1
+
+    def stats(self):
+        """Richieste e latenze (p50/p95) per livello"""
+        with self.lock:
+            counts = dict(self.counts)
+        return {
+            tier: {
+                "deployment": self.deployments[tier],
+                "requests": counts[tier],
+                "p50": self.latency[tier].percentile(50),
+                "p95": self.latency[tier].percentile(95)
+            }
+            for tier in self.deployments
+        }
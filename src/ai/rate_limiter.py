@@ -0,0 +1,271 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+
+try:
+    from .deadline import DeadlineExceeded
+    from .cancellation import RequestCancelled
+except ImportError:
+    from deadline import DeadlineExceeded
+    from cancellation import RequestCancelled
+
+# Ogni quanto chi è in fila dietro un altro thread controlla se la richiesta è stata annullata (secondi)
+QUEUE_POLL = 0.1
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(endpoint, deployment):
+    """Limitatore condiviso da tutti i client del processo per lo stesso deployment"""
+    key = (endpoint, deployment)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(name=f"{endpoint}|{deployment}")
+        return _limiters[key]
+
+
+def retry_after(error, default=1.0):
+    """Secondi di attesa suggeriti da una risposta 429"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return default
+
+
+class RateLimiter:
+    """Token bucket per richieste e token al minuto: in caso di quota esaurita si aspetta in coda"""
+
+    def __init__(self, name="default", rpm=None, tpm=None, path=None):
+        self.name = name
+        # 0 = nessun limite finché gli header di Azure non indicano la quota reale
+        self.limits = {
+            "requests": float(rpm if rpm is not None else os.getenv("AZURE_AI_RPM", 0)),
+            "tokens": float(tpm if tpm is not None else os.getenv("AZURE_AI_TPM", 0))
+        }
+        self.estimated = {kind for kind, limit in self.limits.items() if not limit}
+        self.path = path or os.getenv("AZURE_AI_RATE_LIMIT_DB")
+
+        now = time.time()
+        self.levels = {kind: limit for kind, limit in self.limits.items()}
+        self.updated = now
+        self.blocked_until = 0.0
+
+        self.lock = threading.Lock()
+        # Chi aspetta lo fa in fila: un solo thread alla volta attende la ricarica
+        self.queue = threading.Lock()
+        self.local = threading.local()
+        self.counters = {"requests": 0, "waited": 0, "wait_seconds": 0.0, "throttled": 0, "out_of_budget": 0}
+
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db().execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "name TEXT PRIMARY KEY, requests REAL, tokens REAL, updated REAL, blocked_until REAL)"
+            )
+
+    def acquire(self, tokens, deadline=None, cancel=None):
+        """Attende finché c'è quota per una richiesta da tokens token stimati (non oltre deadline, fino a cancel)"""
+        while not self.queue.acquire(timeout=QUEUE_POLL if cancel is not None else -1):
+            self._check_cancel(cancel)
+        try:
+            wait_total = 0.0
+            while True:
+                self._check_cancel(cancel)
+                wait = self._take(tokens)
+                if wait <= 0:
+                    break
+                self._check_budget(deadline, wait)
+                if cancel is None:
+                    time.sleep(min(wait, 1.0))
+                else:
+                    cancel.wait(min(wait, 1.0))
+                wait_total += min(wait, 1.0)
+        finally:
+            self.queue.release()
+        self._count(wait_total)
+        return wait_total
+
+    async def acquire_async(self, tokens, deadline=None):
+        """Come acquire(), senza bloccare l'event loop"""
+        wait_total = 0.0
+        while True:
+            wait = self._take(tokens)
+            if wait <= 0:
+                break
+            self._check_budget(deadline, wait)
+            await asyncio.sleep(min(wait, 1.0))
+            wait_total += min(wait, 1.0)
+        self._count(wait_total)
+        return wait_total
+
+    @staticmethod
+    def _check_cancel(cancel):
+        if cancel is not None and cancel.is_set():
+            raise RequestCancelled("Richiesta annullata durante l'attesa della quota")
+
+    def try_acquire(self, tokens):
+        """Preleva la quota solo se è disponibile subito; ritorna False altrimenti"""
+        if self._take(tokens) > 0:
+            return False
+        self._count(0.0)
+        return True
+
+    def refund(self, tokens, requests=0):
+        """Restituisce la quota presa in più: token stimati oltre l'uso reale o una richiesta mai servita"""
+        def give_back(state):
+            for kind, amount in (("requests", requests), ("tokens", tokens)):
+                if amount > 0 and self.limits[kind]:
+                    state[kind] = min(self.limits[kind], state[kind] + amount)
+
+        if tokens > 0 or requests > 0:
+            self._update(give_back)
+
+    def update_from_headers(self, headers):
+        """Allinea i bucket alla quota residua comunicata da Azure (x-ratelimit-*)"""
+        def apply(state):
+            for kind in ("requests", "tokens"):
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if remaining is None:
+                    continue
+                remaining = float(remaining)
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                unlimited = not self.limits[kind]
+
+                if limit:
+                    self.limits[kind] = float(limit)
+                elif kind in self.estimated:
+                    # Senza limite dichiarato la quota si stima dal residuo più alto visto
+                    self.limits[kind] = max(self.limits[kind], remaining + 1)
+                state[kind] = remaining if unlimited else min(state[kind], remaining)
+        try:
+            self._update(apply)
+        except ValueError:
+            pass
+
+    def throttle(self, seconds):
+        """Blocca tutte le richieste per seconds secondi (dopo un 429)"""
+        until = time.time() + seconds
+        self._update(lambda state: state.update(blocked_until=max(state["blocked_until"], until)))
+        with self.lock:
+            self.counters["throttled"] += 1
+
+    def snapshot(self):
+        """Quota attuale ricaricata fino ad ora, senza prelevarne: requests, tokens e blocked_until"""
+        if not self.path:
+            with self.lock:
+                state = {"requests": self.levels["requests"], "tokens": self.levels["tokens"],
+                         "updated": self.updated, "blocked_until": self.blocked_until}
+        else:
+            row = self._db().execute(
+                "SELECT requests, tokens, updated, blocked_until FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            if row is None:
+                row = (self.limits["requests"], self.limits["tokens"], time.time(), 0.0)
+            state = dict(zip(("requests", "tokens", "updated", "blocked_until"), row))
+        self._refill(state)
+        return state
+
+    def stats(self):
+        """Ritorna limiti e contatori"""
+        with self.lock:
+            return dict(self.counters, rpm=self.limits["requests"], tpm=self.limits["tokens"])
+
+    def _check_budget(self, deadline, wait):
+        if deadline is not None and wait >= deadline.remaining():
+            with self.lock:
+                self.counters["out_of_budget"] += 1
+            raise DeadlineExceeded("Quota non disponibile entro il tempo della richiesta")
+
+    def _take(self, tokens):
+        """Preleva la quota se disponibile; altrimenti ritorna i secondi da attendere"""
+        result = {}
+
+        def take(state):
+            now = time.time()
+            if state["blocked_until"] > now:
+                result["wait"] = state["blocked_until"] - now
+                return
+            need = {"requests": 1.0, "tokens": float(tokens)}
+            wait = 0.0
+            for kind, limit in self.limits.items():
+                if not limit:
+                    continue
+                amount = min(need[kind], limit)
+                if state[kind] < amount:
+                    wait = max(wait, (amount - state[kind]) / (limit / 60.0))
+            if wait <= 0:
+                for kind, limit in self.limits.items():
+                    if limit:
+                        state[kind] -= min(need[kind], limit)
+            result["wait"] = wait
+
+        self._update(take)
+        return result["wait"]
+
+    def _update(self, change):
+        """Ricarica i bucket e applica change allo stato, in memoria o su SQLite"""
+        if not self.path:
+            with self.lock:
+                state = {"requests": self.levels["requests"], "tokens": self.levels["tokens"],
+                         "updated": self.updated, "blocked_until": self.blocked_until}
+                self._refill(state)
+                change(state)
+                self.levels = {"requests": state["requests"], "tokens": state["tokens"]}
+                self.updated = state["updated"]
+                self.blocked_until = state["blocked_until"]
+            return
+
+        # Con SQLite lo stato è condiviso tra i worker: transazione esclusiva
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT requests, tokens, updated, blocked_until FROM buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            if row is None:
+                row = (self.limits["requests"], self.limits["tokens"], time.time(), 0.0)
+            state = dict(zip(("requests", "tokens", "updated", "blocked_until"), row))
+            self._refill(state)
+            change(state)
+            db.execute(
+                "INSERT OR REPLACE INTO buckets (name, requests, tokens, updated, blocked_until) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.name, state["requests"], state["tokens"], state["updated"], state["blocked_until"])
+            )
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def _refill(self, state):
+        now = time.time()
+        elapsed = max(0.0, now - state["updated"])
+        for kind, limit in self.limits.items():
+            if limit:
+                state[kind] = min(limit, state[kind] + elapsed * limit / 60.0)
+        state["updated"] = now
+
+    def _count(self, wait_total):
+        with self.lock:
+            self.counters["requests"] += 1
+            if wait_total > 0:
+                self.counters["waited"] += 1
+                self.counters["wait_seconds"] += wait_total
+
+    def _db(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            self.local.db = db
+        return db
@@ -0,0 +1,371 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from openai import APIConnectionError, APIStatusError, InternalServerError, RateLimitError
+
+try:
+    from .rate_limiter import retry_after
+    from .deadline import DeadlineExceeded
+    from .cancellation import RequestCancelled
+except ImportError:
+    from rate_limiter import retry_after
+    from deadline import DeadlineExceeded
+    from cancellation import RequestCancelled
+
+# Errori per cui ha senso riprovare (APITimeoutError è una APIConnectionError)
+TRANSIENT_ERRORS = (APIConnectionError, InternalServerError, RateLimitError)
+
+_policies = {}
+_policies_lock = threading.Lock()
+_hedge_executor = None
+
+
+def _hedge_pool():
+    """Thread delle sole richieste di riserva (AZURE_AI_HEDGE_THREADS), creati al primo hedge"""
+    global _hedge_executor
+    with _policies_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=int(os.getenv("AZURE_AI_HEDGE_THREADS", 32)),
+                                                 thread_name_prefix="hedge")
+        return _hedge_executor
+
+
+def get_resilience(endpoint, deployment):
+    """Politica di resilienza condivisa da tutti i client del processo per lo stesso deployment"""
+    key = (endpoint, deployment)
+    with _policies_lock:
+        if key not in _policies:
+            _policies[key] = Resilience()
+        return _policies[key]
+
+
+class CircuitOpenError(Exception):
+    """L'endpoint è considerato non disponibile: la richiesta fallisce subito"""
+
+
+class CircuitBreaker:
+    """Apre il circuito dopo troppi errori consecutivi e riprova dopo un periodo di pausa"""
+
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half_open" if time.time() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        """Solleva CircuitOpenError se il circuito è aperto"""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.time() - self.opened_at < self.cooldown or self.trial:
+                raise CircuitOpenError("Servizio AI temporaneamente non disponibile")
+            # Mezzo aperto: passa una sola richiesta di prova
+            self.trial = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def release(self):
+        """Libera la richiesta di prova senza giudicare l'endpoint (annullata, scaduta, errore locale)"""
+        with self.lock:
+            self.trial = False
+
+    def record_failure(self):
+        """Ritorna True se questo errore ha aperto il circuito"""
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                was_open = self.opened_at is not None
+                self.opened_at = time.time()
+                self.trial = False
+                return not was_open
+            return False
+
+
+class LatencyTracker:
+    """Latenze recenti delle chiamate riuscite, per calcolare i percentili"""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p):
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class Resilience:
+    """Retry con backoff esponenziale e jitter, richieste hedged e circuit breaker"""
+
+    def __init__(self):
+        self.max_attempts = max(1, int(os.getenv("AZURE_AI_MAX_ATTEMPTS", 4)))
+        self.base_delay = float(os.getenv("AZURE_AI_RETRY_BASE_DELAY", 0.5))
+        self.max_delay = float(os.getenv("AZURE_AI_RETRY_MAX_DELAY", 8.0))
+        # Hedging: seconda richiesta se la prima supera il p95 delle latenze recenti
+        self.hedging = os.getenv("AZURE_AI_HEDGE", "0") == "1"
+        self.hedge_percentile = float(os.getenv("AZURE_AI_HEDGE_PERCENTILE", 95))
+        self.hedge_min_delay = float(os.getenv("AZURE_AI_HEDGE_MIN_DELAY", 0.5))
+
+        self.breaker = CircuitBreaker(
+            threshold=int(os.getenv("AZURE_AI_BREAKER_THRESHOLD", 5)),
+            cooldown=float(os.getenv("AZURE_AI_BREAKER_COOLDOWN", 30))
+        )
+        self.latency = LatencyTracker()
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "hedges": 0, "hedge_wins": 0,
+                         "hedge_discarded": 0, "breaker_opened": 0, "short_circuited": 0, "out_of_budget": 0}
+
+    def call(self, fn, hedge=False, attempts=None, deadline=None, on_discard=None, calls=None):
+        """Esegue fn() con retry, hedging (se richiesto) e circuit breaker, entro deadline se data"""
+        # on_discard(risposta) riceve la risposta della richiesta hedged che ha perso, per chiuderla e contarla;
+        # calls (UpstreamCalls) ferma l'attesa tra i tentativi e interrompe la richiesta che ha perso
+        self._count("calls")
+        attempts = attempts or self.max_attempts
+        cancel = calls.cancel if calls is not None else None
+        for attempt in range(1, attempts + 1):
+            self._allow()
+            start = time.time()
+            try:
+                result = self._hedged(fn, on_discard, calls) if hedge and self.hedging else fn()
+            except TRANSIENT_ERRORS as e:
+                delay = self._on_error(e, attempt, attempts)
+                self._check_budget(deadline, delay, e)
+                if cancel is None:
+                    time.sleep(delay)
+                elif cancel.wait(delay):
+                    raise RequestCancelled("Richiesta annullata durante l'attesa del nuovo tentativo") from e
+                continue
+            except APIStatusError:
+                # L'endpoint ha risposto (es. richiesta non valida): è sano
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                # Annullata, scaduta o errore locale: non dice nulla sull'endpoint
+                self.breaker.release()
+                raise
+            self._on_success(start, hedge)
+            return result
+
+    async def call_async(self, fn, hedge=False, attempts=None, deadline=None, on_discard=None):
+        """Come call(), per fn() che ritorna una coroutine"""
+        # Anche on_discard qui è una funzione async
+        self._count("calls")
+        attempts = attempts or self.max_attempts
+        for attempt in range(1, attempts + 1):
+            self._allow()
+            start = time.time()
+            try:
+                result = await (self._hedged_async(fn, on_discard) if hedge and self.hedging else fn())
+            except TRANSIENT_ERRORS as e:
+                delay = self._on_error(e, attempt, attempts)
+                self._check_budget(deadline, delay, e)
+                await asyncio.sleep(delay)
+                continue
+            except APIStatusError:
+                # L'endpoint ha risposto (es. richiesta non valida): è sano
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                # Annullata (anche CancelledError), scaduta o errore locale: non dice nulla sull'endpoint
+                self.breaker.release()
+                raise
+            self._on_success(start, hedge)
+            return result
+
+    def stats(self):
+        """Ritorna contatori, stato del circuito e latenze"""
+        with self.lock:
+            stats = dict(self.counters)
+        stats["breaker"] = self.breaker.state
+        stats["p50"] = self.latency.percentile(50)
+        stats["p95"] = self.latency.percentile(95)
+        return stats
+
+    def hedge_delay(self):
+        """Dopo quanti secondi partire con la richiesta di riserva (None: non abbastanza dati)"""
+        if len(self.latency) < 20:
+            return None
+        return max(self.hedge_min_delay, self.latency.percentile(self.hedge_percentile))
+
+    def _allow(self):
+        try:
+            self.breaker.allow()
+        except CircuitOpenError:
+            self._count("short_circuited")
+            raise
+
+    def _on_error(self, error, attempt, attempts):
+        """Registra l'errore e ritorna l'attesa prima del prossimo tentativo (o lo rilancia)"""
+        self._count("failures")
+        # Un 429 vuol dire endpoint sano ma occupato: non conta per il circuito
+        if isinstance(error, RateLimitError):
+            self.breaker.record_success()
+        elif self.breaker.record_failure():
+            self._count("breaker_opened")
+            print(f"⚠️ Circuito aperto dopo errori ripetuti: {error}")
+        if attempt == attempts:
+            raise error
+
+        self._count("retries")
+        # Full jitter: attesa casuale tra 0 e il backoff esponenziale
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if isinstance(error, RateLimitError):
+            delay = max(delay, retry_after(error))
+        return delay
+
+    def _check_budget(self, deadline, delay, error):
+        # Inutile attendere un nuovo tentativo che non avrebbe tempo di finire
+        if deadline is not None and delay >= deadline.remaining():
+            self._count("out_of_budget")
+            raise DeadlineExceeded(f"Tempo esaurito dopo l'errore: {error}") from error
+
+    def _on_success(self, start, record_latency):
+        self.breaker.record_success()
+        if record_latency:
+            self.latency.add(time.time() - start)
+
+    def _hedged(self, fn, on_discard=None, calls=None):
+        delay = self.hedge_delay()
+        if delay is None:
+            return fn()
+
+        # La prima richiesta gira nel thread di chi chiama: nel pool va solo quella di riserva
+        caller = threading.get_ident()
+        lock = threading.Lock()
+        state = {"finished": False, "second": None, "second_won": False}
+
+        def second_done(future):
+            with lock:
+                if state["finished"] or future.exception() is not None:
+                    return
+                state["second_won"] = True
+            # La riserva ha risposto prima: si interrompe la prima, così chi chiama non la aspetta
+            if calls is not None:
+                calls.interrupt(caller)
+
+        def launch():
+            with lock:
+                if state["finished"]:
+                    return
+                self._count("hedges")
+                state["second"] = _hedge_pool().submit(fn)
+            state["second"].add_done_callback(second_done)
+
+        timer = threading.Timer(delay, launch)
+        timer.daemon = True
+        timer.start()
+        result = error = None
+        try:
+            result = fn()
+        except Exception as e:
+            error = e
+        finally:
+            timer.cancel()
+            with lock:
+                state["finished"] = True
+            if calls is not None:
+                calls.resume(caller)
+
+        second = state["second"]
+        if second is None:
+            if error is not None:
+                raise error
+            return result
+        if error is None and not state["second_won"]:
+            # Un thread non si interrompe: la riserva si chiude e si conta appena finisce
+            second.add_done_callback(lambda f: self._discard(f.exception() or f.result(), on_discard))
+            return result
+        if error is None:
+            self._discard(result, on_discard)
+        try:
+            result = second.result()
+        except Exception:
+            raise error or second.exception()
+        self._count("hedge_wins")
+        return result
+
+    async def _hedged_async(self, fn, on_discard=None):
+        delay = self.hedge_delay()
+        if delay is None:
+            return await fn()
+
+        first = asyncio.ensure_future(fn())
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+
+            self._count("hedges")
+            second = asyncio.ensure_future(fn())
+            pending = {first, second}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        loser = second if task is first else first
+                        # La richiesta più lenta viene annullata; se ha già risposto si chiude e si conta
+                        if not loser.cancel() and not loser.cancelled():
+                            await self._discard_async(loser.exception() or loser.result(), on_discard)
+                        if task is second:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        except asyncio.CancelledError:
+            # Chi aspettava la risposta è stato annullato: non si lasciano richieste orfane
+            for task in pending:
+                task.cancel()
+            raise
+
+    def _discard(self, result, on_discard):
+        if isinstance(result, BaseException):
+            return
+        self._count("hedge_discarded")
+        if on_discard is not None:
+            try:
+                on_discard(result)
+            except Exception as e:
+                print(f"⚠️ Risposta hedged scartata non chiusa: {e}")
+
+    async def _discard_async(self, result, on_discard):
+        """Come _discard(), per on_discard che ritorna una coroutine"""
+        if isinstance(result, BaseException):
+            return
+        self._count("hedge_discarded")
+        if on_discard is not None:
+            try:
+                await on_discard(result)
+            except Exception as e:
+                print(f"⚠️ Risposta hedged scartata non chiusa: {e}")
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
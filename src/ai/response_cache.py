@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def normalize_prompt(text):
+    """Normalizza un prompt: minuscole e spazi compattati"""
+    return " ".join((text or "").casefold().split())
+
+
+class ResponseCache:
+    """Cache delle risposte a due livelli: LRU in memoria più SQLite condiviso tra i worker"""
+
+    def __init__(self, max_entries=None, ttl=None, path=None, max_disk_entries=None):
+        self.max_entries = max_entries or int(os.getenv("AZURE_AI_CACHE_SIZE", 1000))
+        self.ttl = ttl or float(os.getenv("AZURE_AI_CACHE_TTL", 86400))
+        self.path = path or os.getenv("AZURE_AI_CACHE_PATH", "data/response_cache.sqlite3")
+        self.max_disk_entries = max_disk_entries or int(os.getenv("AZURE_AI_CACHE_DISK_SIZE", 50000))
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db().execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, created REAL NOT NULL)"
+        )
+
+    def make_key(self, messages, deployment, temperature):
+        """Chiave: ultimo prompt normalizzato, contesto precedente, deployment e temperatura"""
+        context = json.dumps(
+            [[m["role"], m.get("content")] for m in messages[:-1]],
+            ensure_ascii=False, separators=(",", ":")
+        )
+        prompt = normalize_prompt(messages[-1].get("content"))
+        raw = "\x1f".join((deployment, f"{temperature:.3f}", context, prompt))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Ritorna la risposta in cache o None"""
+        now = time.time()
+
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[1]
+                del self.memory[key]
+
+        row = self._db().execute(
+            "SELECT value, expires FROM responses WHERE key = ? AND expires > ?", (key, now)
+        ).fetchone()
+
+        with self.lock:
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            self._remember(key, row[1], row[0])
+        return row[0]
+
+    def set(self, key, value):
+        """Salva una risposta in entrambi i livelli"""
+        now = time.time()
+        expires = now + self.ttl
+
+        with self.lock:
+            self._remember(key, expires, value)
+            self.counters["stores"] += 1
+            prune = self.counters["stores"] % 100 == 0
+
+        db = self._db()
+        db.execute(
+            "INSERT OR REPLACE INTO responses (key, value, expires, created) VALUES (?, ?, ?, ?)",
+            (key, value, expires, now)
+        )
+        if prune:
+            self._prune(db, now)
+
+    def stats(self):
+        """Ritorna contatori e hit rate"""
+        with self.lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self.memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _remember(self, key, expires, value):
+        self.memory[key] = (expires, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _prune(self, db, now):
+        """Rimuove le voci scadute e le più vecchie oltre il limite su disco"""
+        db.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+        db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
+
+    def _db(self):
+        # Una connessione per thread; WAL permette letture concorrenti tra processi
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
@@ -0,0 +1,284 @@
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import threading
+import numpy as np
+
+try:
+    from .response_cache import normalize_prompt
+except ImportError:
+    from response_cache import normalize_prompt
+
+
+# Parole che non cambiano il senso di una domanda (articoli, preposizioni, ausiliari, cortesie).
+# Negazioni e parole interrogative restano: "come"/"dove" o "non" cambiano la risposta.
+STOPWORDS = frozenset("""
+il lo la i gli le un uno una di a da in con su per tra fra del dello della dei degli delle
+al allo alla ai agli alle dal dallo dalla dai dagli dalle nel nello nella nei negli nelle
+sul sullo sulla sui sugli sulle e ed o od ma mi ti si ci vi me te se è sono sei siamo siete
+ho hai ha abbiamo avete hanno posso puoi può possiamo potete possono potrei potresti potrebbe
+vorrei voglio vuoi devo devi deve mio mia tuo tua favore grazie ciao scusa salve
+the an of to is are do does can could please
+""".split())
+
+# Desinenze tolte per confrontare forme diverse della stessa parola (installare/installa)
+SUFFIXES = ("azioni", "azione", "mente", "ando", "endo", "are", "ere", "ire",
+            "ato", "ata", "ati", "ate", "ito", "ita", "iti", "ite", "a", "e", "i", "o")
+
+
+def stem(word):
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def key_terms(text):
+    """Parole chiave di un prompt, nell'ordine: numeri così come sono, le altre senza desinenza"""
+    # La punteggiatura non cambia il senso di una domanda
+    words = normalize_prompt(re.sub(r"[^\w\s]", " ", text or "")).split()
+    return [w if any(c.isdigit() for c in w) else stem(w) for w in words if w not in STOPWORDS]
+
+
+def same_terms(a, b):
+    """Vero se due prompt hanno gli stessi numeri e le stesse parole chiave (in qualsiasi ordine)"""
+    return set(a) == set(b)
+
+
+def embed(text, dim=256):
+    """Vettore locale del testo: n-grammi di caratteri e parole chiave proiettati con hashing"""
+    terms = key_terms(text)
+    text = " ".join(terms) if terms else normalize_prompt(text)
+    vector = np.zeros(dim, dtype=np.float32)
+
+    padded = f" {text} "
+    features = [padded[i:i + 3] for i in range(len(padded) - 2)]
+    features += [f"w:{word}" for word in text.split()]
+
+    for feature in features:
+        h = zlib.crc32(feature.encode("utf-8"))
+        # Il bit alto decide il segno, così le collisioni tendono ad annullarsi
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+class SemanticCache:
+    """Cache di risposte per prompt simili, con indice vettoriale locale in NumPy"""
+
+    def __init__(self, threshold=None, max_entries=None, dim=256, tables=12, bits=12):
+        self.threshold = threshold or float(os.getenv("AZURE_AI_SEMANTIC_THRESHOLD", 0.95))
+        self.max_entries = max_entries or int(os.getenv("AZURE_AI_SEMANTIC_SIZE", 100000))
+        self.dim = dim
+        self.tables = tables
+        self.bits = bits
+
+        # Iperpiani casuali per l'indice LSH: prompt simili finiscono negli stessi bucket
+        rng = np.random.default_rng(0)
+        self.planes = rng.standard_normal((tables * bits, dim)).astype(np.float32)
+        self.powers = 1 << np.arange(bits)
+
+        capacity = min(self.max_entries, 1024)
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.signatures = np.zeros((capacity, tables), dtype=np.int64)
+        self.answers = [None] * capacity
+        self.terms = [None] * capacity
+        self.row_namespace = [None] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+        self.buckets = {}
+        self.size = 0
+
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def namespace(self, context, deployment, temperature):
+        """Spazio di ricerca: solo prompt con lo stesso contesto e gli stessi parametri"""
+        raw = json.dumps([[m["role"], m.get("content")] for m in context], ensure_ascii=False)
+        raw = f"{deployment}\x1f{temperature:.3f}\x1f{raw}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def search(self, prompt, namespace, k=1):
+        """Ritorna fino a k coppie (similarità, risposta), dalla più simile, tra prompt con le stesse parole chiave"""
+        # Un vettore simile non basta: "crescente"/"decrescente" o "5678"/"5679" sono domande diverse
+        terms = key_terms(prompt)
+        query = embed(prompt, self.dim)
+        signature = self._signature(query)
+
+        with self.lock:
+            candidates = set()
+            for table, sig in enumerate(signature):
+                rows = self.buckets.get((namespace, table, int(sig)))
+                if rows:
+                    candidates.update(rows)
+            if not candidates:
+                return []
+
+            rows = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            scores = self.vectors[rows] @ query
+            top = []
+            for i in np.argsort(-scores):
+                if same_terms(self.terms[rows[i]], terms):
+                    top.append(i)
+                    if len(top) == k:
+                        break
+
+            self.last_used[rows[top]] = time.time()
+            return [(float(scores[i]), self.answers[rows[i]]) for i in top]
+
+    def lookup(self, prompt, namespace):
+        """Ritorna la risposta del prompt più simile sopra la soglia, o None"""
+        results = self.search(prompt, namespace, k=1)
+        hit = bool(results) and results[0][0] >= self.threshold
+        with self.lock:
+            self.counters["hits" if hit else "misses"] += 1
+        return results[0][1] if hit else None
+
+    def add(self, prompt, namespace, answer):
+        """Indicizza la risposta di un prompt"""
+        vector = embed(prompt, self.dim)
+        signature = self._signature(vector)
+        terms = key_terms(prompt)
+
+        with self.lock:
+            if not self.free:
+                if len(self.answers) < self.max_entries:
+                    self._grow()
+                else:
+                    self._evict()
+            row = self.free.pop()
+
+            self.vectors[row] = vector
+            self.signatures[row] = signature
+            self.last_used[row] = time.time()
+            self.answers[row] = answer
+            self.terms[row] = terms
+            self.row_namespace[row] = namespace
+            for table, sig in enumerate(signature):
+                self.buckets.setdefault((namespace, table, int(sig)), set()).add(row)
+            self.size += 1
+            self.counters["stores"] += 1
+
+    def stats(self):
+        """Ritorna contatori e numero di voci"""
+        with self.lock:
+            stats = dict(self.counters, entries=self.size)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _signature(self, vector):
+        bits = (self.planes @ vector > 0).reshape(self.tables, self.bits)
+        return bits @ self.powers
+
+    def _grow(self):
+        old = len(self.answers)
+        new = min(old * 2, self.max_entries)
+        for name in ("vectors", "last_used", "signatures"):
+            array = getattr(self, name)
+            grown = np.zeros((new,) + array.shape[1:], dtype=array.dtype)
+            grown[:old] = array
+            setattr(self, name, grown)
+        self.answers.extend([None] * (new - old))
+        self.terms.extend([None] * (new - old))
+        self.row_namespace.extend([None] * (new - old))
+        self.free.extend(range(new - 1, old - 1, -1))
+
+    def _evict(self):
+        """Libera l'1% delle voci usate meno di recente"""
+        count = max(1, len(self.answers) // 100)
+        for row in np.argpartition(self.last_used, count)[:count]:
+            row = int(row)
+            namespace = self.row_namespace[row]
+            for table, sig in enumerate(self.signatures[row]):
+                key = (namespace, table, int(sig))
+                bucket = self.buckets.get(key)
+                if bucket is not None:
+                    bucket.discard(row)
+                    if not bucket:
+                        del self.buckets[key]
+            self.answers[row] = None
+            self.terms[row] = None
+            self.row_namespace[row] = None
+            self.free.append(row)
+            self.size -= 1
+            self.counters["evictions"] += 1
+
+
+# Benchmark
+if __name__ == "__main__":
+    print("=" * 60)
+    print("⏱️ BENCHMARK SEMANTIC CACHE")
+    print("=" * 60)
+
+    # Vocabolario sintetico: parole diverse come in prompt reali
+    rng = np.random.default_rng(42)
+    syllables = ["ca", "to", "ri", "ne", "la", "mo", "pe", "si", "go", "da", "fu", "ve", "zi", "bo", "le", "mi"]
+    words = ["".join(rng.choice(syllables, size=rng.integers(2, 4))) for _ in range(3000)]
+
+    entries = 100000
+    cache = SemanticCache(max_entries=entries)
+    prompts = []
+    for _ in range(entries):
+        prompt = list(rng.choice(words, size=rng.integers(6, 14)))
+        if rng.random() < 0.3:
+            # Un prompt su tre contiene un numero
+            prompt.insert(int(rng.integers(0, len(prompt))), str(rng.integers(1, 10000)))
+        prompts.append(" ".join(prompt))
+
+    start = time.perf_counter()
+    for i, prompt in enumerate(prompts):
+        cache.add(prompt, "faq", f"risposta {i}")
+    print(f"📥 Inserite {entries} voci in {time.perf_counter() - start:.1f}s")
+
+    def changed(prompt):
+        """La stessa domanda con una parola chiave o un numero diversi: una cache corretta non risponde"""
+        tokens = prompt.split()
+        i = int(rng.integers(0, len(tokens)))
+        if tokens[i].isdigit():
+            tokens[i] = str(int(tokens[i]) + 1)
+        else:
+            tokens[i] = next(w for w in rng.choice(words, size=10) if stem(w) != stem(tokens[i]))
+        return " ".join(tokens)
+
+    picked = rng.integers(0, entries, size=1000)
+    # Parafrasi: stessa domanda con maiuscole, punteggiatura e una cortesia in più
+    queries = [prompts[i].capitalize() + ", per favore?" for i in picked]
+    negatives = [changed(prompts[i]) for i in picked]
+
+    timings = []
+    hits = false_positives = 0
+    for query, negative in zip(queries, negatives):
+        start = time.perf_counter()
+        hits += cache.lookup(query, "faq") is not None
+        timings.append((time.perf_counter() - start) * 1000)
+        false_positives += cache.lookup(negative, "faq") is not None
+
+    timings.sort()
+    print(f"🔎 Lookup: p50 {timings[500]:.3f} ms, p99 {timings[990]:.3f} ms")
+    print(f"🎯 Hit su parafrasi: {hits}/{len(queries)}")
+    print(f"🚫 Falsi positivi (una parola o un numero diversi): {false_positives}/{len(negatives)}")
+
+    # Casi reali: (prompt in cache, domanda, deve rispondere dalla cache?)
+    cases = [
+        ("Ordina questi numeri in ordine crescente", "Ordina questi numeri in ordine decrescente", False),
+        ("Quanto fa 1234 moltiplicato per 5678?", "Quanto fa 1234 moltiplicato per 5679?", False),
+        ("Quanto fa 12 per 13?", "Quanto fa 12 per 14?", False),
+        ("Come posso installare Python su Windows?", "Come si installa Python su Windows?", True),
+        ("Dove si installa Python?", "Come si installa Python?", False),
+    ]
+    for stored, query, expected in cases:
+        real = SemanticCache()
+        real.add(stored, "faq", "ok")
+        hit = real.lookup(query, "faq") is not None
+        score = float(embed(stored) @ embed(query))
+        print(f"{'✅' if hit == expected else '❌'} {score:.3f} {'hit ' if hit else 'miss'} {stored!r} → {query!r}")
+
+    print(f"📊 Statistiche: {cache.stats()}")
+    print("=" * 60)
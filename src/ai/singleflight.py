@@ -0,0 +1,230 @@
+import asyncio
+import threading
+
+try:
+    from .cancellation import RequestCancelled
+except ImportError:
+    from cancellation import RequestCancelled
+
+
+class _Flight:
+    """Una chiamata upstream in corso e i pezzi di risposta ricevuti finora"""
+
+    def __init__(self, abort=None):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.abandoned = False
+        self.abort = abort
+        self.cond = threading.Condition()
+
+
+class SingleFlight:
+    """Unisce le richieste identiche in corso: una sola chiamata upstream, risultato per tutti"""
+
+    def __init__(self, coalesce=True):
+        # Con coalesce=False ogni richiesta ha la sua chiamata, ma gira comunque nel thread della flight
+        self.coalesce = coalesce
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.counters = {"upstream_calls": 0, "coalesced": 0, "abandoned": 0}
+
+    def stream(self, key, produce, cancel=None, abort=None):
+        """Genera i pezzi della risposta; produce() viene chiamato una sola volta per chiave
+
+        cancel (CancelToken) interrompe subito l'attesa; abort() ferma la chiamata quando nessuno la legge più.
+        """
+        if not self.coalesce:
+            key = object()
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = _Flight(abort)
+                self.flights[key] = flight
+                self.counters["upstream_calls"] += 1
+                started = True
+            else:
+                self.counters["coalesced"] += 1
+                started = False
+            flight.subscribers += 1
+
+        # La chiamata gira in un thread proprio, così chi si disconnette non blocca gli altri
+        if started:
+            threading.Thread(
+                target=self._run, args=(key, flight, produce), daemon=True, name="singleflight"
+            ).start()
+
+        # L'annullamento sveglia subito chi aspetta, anche prima del primo pezzo
+        unsubscribe = cancel.subscribe(lambda: self._wake(flight)) if cancel is not None else None
+        try:
+            index = 0
+            while True:
+                with flight.cond:
+                    while index >= len(flight.chunks) and not flight.done:
+                        if cancel is not None and cancel.is_set():
+                            raise RequestCancelled("Richiesta annullata")
+                        flight.cond.wait()
+                    pending = flight.chunks[index:]
+                    finished = flight.done
+                index += len(pending)
+                yield from pending
+                if finished and index >= len(flight.chunks):
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            if unsubscribe is not None:
+                unsubscribe()
+            self._leave(key, flight)
+
+    def do(self, key, produce, cancel=None, abort=None):
+        """Come stream(), ma ritorna la risposta completa"""
+        return "".join(self.stream(key, produce, cancel, abort))
+
+    def stats(self):
+        """Ritorna chiamate upstream, richieste risparmiate e chiamate in corso"""
+        with self.lock:
+            return dict(self.counters, in_flight=len(self.flights), coalesce=self.coalesce)
+
+    def _run(self, key, flight, produce):
+        producer = produce()
+        try:
+            for chunk in producer:
+                with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+                if flight.abandoned:
+                    break
+        except Exception as e:
+            # Dopo abort() la lettura fallisce: non è un errore di chi leggeva
+            flight.error = RequestCancelled("Nessun client attende la risposta") if flight.abandoned else e
+        finally:
+            producer.close()
+            # Da qui in poi le nuove richieste partono con una nuova chiamata
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    @staticmethod
+    def _wake(flight):
+        with flight.cond:
+            flight.cond.notify_all()
+
+    def _leave(self, key, flight):
+        # Sotto self.lock nessuno può agganciarsi alla chiamata mentre la si abbandona
+        with self.lock:
+            with flight.cond:
+                flight.subscribers -= 1
+                if flight.subscribers or flight.done:
+                    return
+                flight.abandoned = True
+                flight.error = RequestCancelled("Nessun client attende la risposta")
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            self.counters["abandoned"] += 1
+        # Nessuno legge più: si chiude subito la chiamata upstream, senza aspettare il prossimo pezzo
+        if flight.abort is not None:
+            flight.abort()
+
+
+class _AsyncFlight:
+    """Come _Flight, per una chiamata in corso su asyncio"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.cond = asyncio.Condition()
+        self.task = None
+
+
+class AsyncSingleFlight:
+    """Versione asyncio di SingleFlight: la chiamata upstream gira come task dell'event loop"""
+
+    def __init__(self, coalesce=True):
+        self.coalesce = coalesce
+        self.flights = {}
+        self.counters = {"upstream_calls": 0, "coalesced": 0, "abandoned": 0}
+
+    async def stream(self, key, produce, cancel=None):
+        """Genera i pezzi della risposta; produce() è un generatore asincrono"""
+        if not self.coalesce:
+            key = object()
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = _AsyncFlight()
+            self.flights[key] = flight
+            self.counters["upstream_calls"] += 1
+            # Il riferimento al task evita che venga raccolto dal garbage collector
+            flight.task = asyncio.get_running_loop().create_task(self._run(key, flight, produce))
+        else:
+            self.counters["coalesced"] += 1
+        flight.subscribers += 1
+
+        # cancel viene impostato da un'altra richiesta, anche da un altro thread: si sveglia chi aspetta
+        loop = asyncio.get_running_loop()
+        wake = lambda: loop.call_soon_threadsafe(lambda: loop.create_task(self._wake(flight)))
+        unsubscribe = cancel.subscribe(wake) if cancel is not None else None
+        try:
+            index = 0
+            while True:
+                async with flight.cond:
+                    await flight.cond.wait_for(lambda: index < len(flight.chunks) or flight.done
+                                               or (cancel is not None and cancel.is_set()))
+                    if index >= len(flight.chunks) and not flight.done:
+                        raise RequestCancelled("Richiesta annullata")
+                    pending = flight.chunks[index:]
+                    finished = flight.done
+                index += len(pending)
+                for chunk in pending:
+                    yield chunk
+                if finished and index >= len(flight.chunks):
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            if unsubscribe is not None:
+                unsubscribe()
+            self._leave(key, flight)
+
+    def stats(self):
+        """Ritorna chiamate upstream, richieste risparmiate e chiamate in corso"""
+        return dict(self.counters, in_flight=len(self.flights), coalesce=self.coalesce)
+
+    @staticmethod
+    async def _wake(flight):
+        async with flight.cond:
+            flight.cond.notify_all()
+
+    def _leave(self, key, flight):
+        flight.subscribers -= 1
+        if flight.subscribers or flight.done:
+            return
+        # Nessuno legge più: si cancella subito il task, anche se è fermo in attesa di Azure
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        self.counters["abandoned"] += 1
+        flight.error = RequestCancelled("Nessun client attende la risposta")
+        flight.task.cancel()
+
+    async def _run(self, key, flight, produce):
+        producer = produce()
+        try:
+            async for chunk in producer:
+                async with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            await producer.aclose()
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            async with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
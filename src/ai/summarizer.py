@@ -0,0 +1,115 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+SUMMARY_PREFIX = "Riassunto della conversazione precedente:"
+
+SUMMARY_INSTRUCTIONS = (
+    "Aggiorna il riassunto di una conversazione tra un utente e un assistente. "
+    "Mantieni fatti, preferenze, nomi e richieste ancora aperte. "
+    "Scrivi in italiano, al massimo 150 parole, senza commenti."
+)
+
+
+def is_summary(message):
+    """Vero se il messaggio è il riassunto dei turni più vecchi"""
+    return message["role"] == "system" and (message.get("content") or "").startswith(SUMMARY_PREFIX)
+
+
+def fingerprint(messages):
+    raw = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ConversationSummarizer:
+    """Riassume in background i turni più vecchi di una conversazione"""
+
+    def __init__(self, complete, context, deployment=None, threshold=None, keep_recent=None):
+        # complete(messages, deployment, session_id, **opzioni) ritorna il testo della risposta
+        self.complete = complete
+        self.context = context
+        self.deployment = deployment or os.getenv("AZURE_AI_SUMMARY_MODEL", "gpt-4o-mini")
+        self.threshold = threshold or int(os.getenv("AZURE_AI_SUMMARY_THRESHOLD", 2000))
+        self.keep_recent = keep_recent or int(os.getenv("AZURE_AI_SUMMARY_KEEP", 6))
+
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summarizer")
+        self.pending = set()
+        # Riassunti pronti, applicati al turno successivo: id(storia) -> (fine, impronta, messaggio)
+        self.ready = OrderedDict()
+        self.max_ready = int(os.getenv("AZURE_AI_SUMMARY_READY_MAX", 1000))
+        self.lock = threading.Lock()
+
+    def apply(self, history):
+        """Sostituisce i turni riassunti col riassunto pronto; va chiamato da chi ha in uso la storia"""
+        with self.lock:
+            result = self.ready.pop(id(history), None)
+        if result is None:
+            return False
+        end, digest, summary = result
+        # Storia azzerata, ricaricata dal disco o cambiata nel frattempo: il riassunto non vale più
+        if len(history) < end or fingerprint(history[1:end]) != digest:
+            return False
+        history[1:end] = [summary]
+        print(f"📝 Conversazione riassunta: {end - 1} messaggi compattati")
+        return True
+
+    def maybe_summarize(self, history, session_id=None):
+        """Avvia il riassunto in background se la storia ha superato la soglia"""
+        self.apply(history)
+        start = 2 if len(history) > 1 and is_summary(history[1]) else 1
+        turns = history[start:]
+        if len(turns) <= self.keep_recent:
+            return False
+        if sum(self.context.count(m) for m in turns) < self.threshold:
+            return False
+
+        # Piega i turni più vecchi, fermandosi all'inizio di una domanda
+        end = len(history) - self.keep_recent
+        while end > start and history[end]["role"] != "user":
+            end -= 1
+        if end <= start:
+            return False
+
+        key = id(history)
+        with self.lock:
+            if key in self.pending or key in self.ready:
+                return False
+            self.pending.add(key)
+
+        # Il thread in background lavora su una copia: la storia si tocca solo in apply()
+        previous = history[1]["content"][len(SUMMARY_PREFIX):].strip() if start == 2 else ""
+        self.executor.submit(self._summarize, key, history[start:end], previous, end,
+                             fingerprint(history[1:end]), session_id)
+        return True
+
+    def _summarize(self, key, folded, previous, end, digest, session_id=None):
+        try:
+            transcript = "\n".join(f"{m['role']}: {m.get('content') or ''}" for m in folded)
+            # I token del riassunto sono addebitati alla sessione della conversazione
+            summary = self.complete(
+                [
+                    {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                    {"role": "user", "content": f"Riassunto attuale:\n{previous or '(vuoto)'}\n\n"
+                                                f"Nuovi messaggi:\n{transcript}"}
+                ],
+                self.deployment,
+                session_id,
+                temperature=0.3,
+                max_tokens=300
+            ).strip()
+
+            with self.lock:
+                self.ready[key] = (end, digest, {"role": "system", "content": f"{SUMMARY_PREFIX}\n{summary}"})
+                # Storie che non tornano più (es. sessioni scadute): si scartano i riassunti più vecchi
+                while len(self.ready) > self.max_ready:
+                    self.ready.popitem(last=False)
+
+        except Exception as e:
+            print(f"⚠️ Errore nel riassunto: {e}")
+
+        finally:
+            with self.lock:
+                self.pending.discard(key)
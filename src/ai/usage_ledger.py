@@ -0,0 +1,204 @@
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from datetime import date
+
+# Aggregati mantenuti ad ogni scrittura: (scope, chiave) per giorno
+SCOPES = ("session", "deployment", "day")
+
+LOCAL_SESSION = "local"
+
+
+class BudgetExceeded(Exception):
+    """La sessione ha esaurito il budget giornaliero di token"""
+
+
+class UsageLedger:
+    """Registro dei token usati: eventi in append su SQLite, scritti a blocchi, con aggregati incrementali"""
+
+    def __init__(self, path=None, batch_size=None, flush_interval=None, daily_budget=None, refresh=None):
+        self.path = path or os.getenv("AZURE_AI_USAGE_PATH", "data/usage.sqlite3")
+        self.batch_size = batch_size or int(os.getenv("AZURE_AI_USAGE_BATCH", 100))
+        self.flush_interval = flush_interval or float(os.getenv("AZURE_AI_USAGE_FLUSH_INTERVAL", 2))
+        # Token al giorno per sessione (0 = nessun limite)
+        self.daily_budget = daily_budget if daily_budget is not None else int(os.getenv("AZURE_AI_SESSION_DAILY_TOKENS", 0))
+        # Ogni quanto rileggere il totale di una sessione (altri worker scrivono nello stesso file)
+        self.refresh = refresh or float(os.getenv("AZURE_AI_USAGE_REFRESH", 10))
+
+        self.pending = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # (sessione, giorno) -> [token su disco, letto alle]; unflushed: token non ancora scritti
+        self.spent = {}
+        self.unflushed = {}
+        self.counters = {"events": 0, "flushes": 0, "flush_errors": 0, "rejected": 0}
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = self._db()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS usage_events ("
+            "ts REAL NOT NULL, day TEXT NOT NULL, session TEXT NOT NULL, deployment TEXT NOT NULL, "
+            "prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, cached_tokens INTEGER NOT NULL, "
+            "latency REAL NOT NULL, stream INTEGER NOT NULL)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS usage_rollups ("
+            "scope TEXT NOT NULL, key TEXT NOT NULL, day TEXT NOT NULL, calls INTEGER NOT NULL, "
+            "prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, cached_tokens INTEGER NOT NULL, "
+            "latency REAL NOT NULL, PRIMARY KEY (scope, key, day))"
+        )
+
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def cached_tokens(usage):
+        details = getattr(usage, "prompt_tokens_details", None)
+        return getattr(details, "cached_tokens", None) or 0
+
+    def record(self, session, deployment, usage, latency, stream=False):
+        """Accoda una chiamata; la scrittura su disco avviene a blocchi in background"""
+        now = time.time()
+        event = (now, date.fromtimestamp(now).isoformat(), session or LOCAL_SESSION, deployment,
+                 usage.prompt_tokens, usage.completion_tokens, self.cached_tokens(usage),
+                 latency, 1 if stream else 0)
+        with self.lock:
+            self.pending.append(event)
+            self.counters["events"] += 1
+            key = (event[2], event[1])
+            self.unflushed[key] = self.unflushed.get(key, 0) + event[4] + event[5]
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def used_today(self, session):
+        """Token usati oggi da una sessione: totale su disco (riletto ogni refresh secondi) più quelli in coda"""
+        key = (session or LOCAL_SESSION, date.today().isoformat())
+        now = time.monotonic()
+        with self.lock:
+            entry = self.spent.get(key)
+        if entry is None or now - entry[1] > self.refresh:
+            row = self._db().execute(
+                "SELECT prompt_tokens + completion_tokens FROM usage_rollups "
+                "WHERE scope = 'session' AND key = ? AND day = ?", key
+            ).fetchone()
+            entry = [row[0] if row else 0, now]
+        with self.lock:
+            self.spent[key] = entry
+            return entry[0] + self.unflushed.get(key, 0)
+
+    def check_budget(self, session):
+        """Solleva BudgetExceeded se la sessione ha finito i token di oggi"""
+        if not self.daily_budget:
+            return
+        used = self.used_today(session)
+        if used >= self.daily_budget:
+            with self.lock:
+                self.counters["rejected"] += 1
+            raise BudgetExceeded(f"Budget giornaliero di token esaurito ({used}/{self.daily_budget})")
+
+    def flush(self):
+        """Scrive gli eventi in coda e aggiorna gli aggregati in un'unica transazione"""
+        with self.lock:
+            events, self.pending = self.pending, []
+        if not events:
+            return
+
+        rollups = {}
+        for ts, day, session, deployment, prompt, completion, cached, latency, stream in events:
+            for scope, key in (("session", session), ("deployment", deployment), ("day", "all")):
+                row = rollups.setdefault((scope, key, day), [0, 0, 0, 0, 0.0])
+                row[0] += 1
+                row[1] += prompt
+                row[2] += completion
+                row[3] += cached
+                row[4] += latency
+
+        db = self._db()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("INSERT INTO usage_events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", events)
+            db.executemany(
+                "INSERT INTO usage_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (scope, key, day) DO UPDATE SET "
+                "calls = calls + excluded.calls, "
+                "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                "cached_tokens = cached_tokens + excluded.cached_tokens, "
+                "latency = latency + excluded.latency",
+                [key + tuple(row) for key, row in rollups.items()]
+            )
+            db.execute("COMMIT")
+        except sqlite3.Error as e:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            with self.lock:
+                # Si riprova al prossimo giro
+                self.pending[:0] = events
+                self.counters["flush_errors"] += 1
+            print(f"⚠️ Registro dei token non scritto: {e}")
+            return
+
+        with self.lock:
+            self.counters["flushes"] += 1
+            for (scope, key, day), row in rollups.items():
+                if scope != "session":
+                    continue
+                tokens = row[1] + row[2]
+                self.unflushed[(key, day)] -= tokens
+                if not self.unflushed[(key, day)]:
+                    del self.unflushed[(key, day)]
+                if (key, day) in self.spent:
+                    self.spent[(key, day)][0] += tokens
+
+    def summary(self, scope, key=None, days=7):
+        """Aggregati degli ultimi days giorni per scope ('session', 'deployment' o 'day')"""
+        if scope not in SCOPES:
+            raise ValueError(f"Scope sconosciuto: {scope}")
+        since = date.fromordinal(date.today().toordinal() - days + 1).isoformat()
+        query = ("SELECT key, day, calls, prompt_tokens, completion_tokens, cached_tokens, latency "
+                 "FROM usage_rollups WHERE scope = ? AND day >= ?")
+        params = [scope, since]
+        if key is not None:
+            query += " AND key = ?"
+            params.append(key)
+        rows = self._db().execute(query + " ORDER BY day DESC, key", params).fetchall()
+        return [{
+            "key": key,
+            "day": day,
+            "calls": calls,
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "cached_tokens": cached,
+            "cached_ratio": round(cached / prompt, 3) if prompt else 0.0,
+            "avg_latency": round(latency / calls, 3) if calls else None
+        } for key, day, calls, prompt, completion, cached, latency in rows]
+
+    def stats(self):
+        today = self.summary("day", days=1)
+        with self.lock:
+            stats = dict(self.counters, pending=len(self.pending), daily_budget=self.daily_budget)
+        stats["today"] = today[0] if today else None
+        return stats
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def _db(self):
+        # Una connessione per thread, come la cache delle risposte; transazioni esplicite
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
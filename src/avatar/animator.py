@@ -1,78 +1,247 @@
 import os
 import time
+import threading
+from collections.abc import Mapping
 from PIL import Image
 
+try:
+    from .atlas import FrameAtlas, load_animation, find_animation
+    from .asset_pack import AssetPack, PACK_PATH
+    from .timeline import Timeline
+except ImportError:
+    from atlas import FrameAtlas, load_animation, find_animation
+    from asset_pack import AssetPack, PACK_PATH
+    from timeline import Timeline
+
+try:
+    from ..ai.metrics import metrics
+except ImportError:
+    try:
+        from ai.metrics import metrics
+    except ImportError:
+        # Animator usato da solo, senza il resto dell'assistente
+        metrics = None
+
+DEFAULT_STATES = {
+    "idle": "assets/images/idle.png",
+    "talking": "assets/images/talking.png",
+    "thinking": "assets/images/thinking.png",
+    "happy": "assets/images/happy.png"
+}
+
+class StateImages(Mapping):
+    """Stato -> primo frame dello stato, in sola lettura; ogni stato si decodifica al primo accesso"""
+    
+    def __init__(self, animator):
+        self.animator = animator
+    
+    def __getitem__(self, state):
+        frame_id = self.animator.frame_id(state) if state in self.animator.states else None
+        if frame_id is None:
+            raise KeyError(state)
+        return self.animator.source_frame(frame_id)
+    
+    def __iter__(self):
+        # Senza pixel non ci sono immagini, come prima del caricamento pigro
+        return iter(self.animator.get_available_states() if self.animator.load_pixels else [])
+    
+    def __len__(self):
+        return sum(1 for _ in self)
+
 class AvatarAnimator:
     """Gestisce le animazioni dell'avatar dell'assistente"""
     
-    def __init__(self):
-        self.current_state = "idle"
-        self.states = {
-            "idle": "assets/images/idle.png",
-            "talking": "assets/images/talking.png",
-            "thinking": "assets/images/thinking.png",
-            "happy": "assets/images/happy.png"
-        }
+    def __init__(self, convert_frame=None, load_pixels=None):
+        self.states = dict(DEFAULT_STATES)
         
-        self.images = {}
+        # Senza pixel (web, CLI) l'avatar tiene solo lo stato e non apre nessun file
+        self.load_pixels = load_pixels if load_pixels is not None else os.getenv("AVATAR_HEADLESS") != "1"
+        
+        # Frame dal pacchetto mappato in memoria se c'è, altrimenti da un atlante riempito stato per stato;
+        # per stato: indici dei frame e durate, decodificati al primo uso
+        self.pack = None
+        self.atlas = FrameAtlas()
+        self.animations = {}
+        self.animations_lock = threading.Lock()
         self.load_images()
+        
+        # Stato e frame corrente dipendono dal tempo: nessuna sleep, transizioni in coda
+        self.timeline = Timeline(self.durations, on_change=self._on_state_change)
+        
+        # Frame pronti da mostrare per (frame dell'atlante, larghezza, device pixel ratio);
+        # convert_frame trasforma l'immagine ridimensionata nel formato della UI (es. QImage)
+        self.convert_frame = convert_frame
+        self.frames = {}
+        self.frames_lock = threading.RLock()
     
     def load_images(self):
-        """Carica tutte le immagini degli stati"""
-        print("🎨 Caricamento immagini avatar...")
+        """Apre il pacchetto degli asset se c'è; i singoli stati si decodificano al primo uso"""
+        if not self.load_pixels:
+            print("🎨 Avatar senza immagini (solo stato)")
+            return
         
-        for state, path in self.states.items():
-            if os.path.exists(path):
-                try:
-                    self.images[state] = Image.open(path)
-                    print(f"✅ Caricato: {state} ({path})")
-                except Exception as e:
-                    print(f"❌ Errore nel caricamento di {path}: {e}")
-            else:
-                print(f"⚠️ File non trovato: {path}")
+        path = os.getenv("AVATAR_PACK_PATH", PACK_PATH)
+        if os.path.exists(path):
+            try:
+                self.pack = AssetPack(path)
+                print(f"📦 Pacchetto avatar: {path} ({len(self.pack)} frame, stati: {self.pack.states})")
+                if self.pack.is_stale():
+                    print("⚠️ Immagini più recenti del pacchetto: rigeneralo con src/avatar/asset_pack.py")
+                return
+            except Exception as e:
+                print(f"⚠️ Pacchetto avatar non valido ({e}), uso le immagini singole")
         
-        if not self.images:
+        missing = [path for path in self.states.values() if find_animation(path) is None]
+        for path in missing:
+            print(f"⚠️ File non trovato: {path}")
+        if len(missing) == len(self.states):
             print("❌ ERRORE: Nessuna immagine caricata!")
-        else:
-            print(f"✅ Immagini caricate: {list(self.images.keys())}")
+    
+    def animation(self, state):
+        """Indici dei frame e durate di uno stato, caricati al primo uso"""
+        animation = self.animations.get(state)
+        if animation is not None:
+            return animation
+        
+        with self.animations_lock:
+            if state in self.animations:
+                return self.animations[state]
+            animation = ([], [0.0])
+            if self.pack is not None:
+                animation = self.pack.animation(state) or animation
+            elif self.load_pixels and state in self.states:
+                path = find_animation(self.states[state])
+                if path:
+                    try:
+                        animation = load_animation(path, self.atlas)
+                        print(f"✅ Caricato: {state} ({path}, {len(animation[0])} frame)")
+                    except Exception as e:
+                        print(f"❌ Errore nel caricamento di {path}: {e}")
+            self.animations[state] = animation
+            return animation
+    
+    def durations(self, state):
+        return self.animation(state)[1]
+    
+    def source_frame(self, frame_id):
+        """Frame a piena risoluzione, dal pacchetto o dall'atlante"""
+        return (self.pack if self.pack is not None else self.atlas).get(frame_id)
+    
+    @property
+    def images(self):
+        """Immagine di ogni stato (primo frame), come il vecchio dizionario images"""
+        return StateImages(self)
+    
+    @property
+    def current_state(self):
+        return self.timeline.tick()[0]
+    
+    def _on_state_change(self, state):
+        if metrics:
+            metrics.avatar_state.inc(state=state)
+        print(f"🔄 Stato cambiato: {state}")
     
     def set_state(self, state):
         """Cambia lo stato dell'avatar"""
         if state in self.states:
-            self.current_state = state
-            print(f"🔄 Stato cambiato: {state}")
+            self.timeline.set(state)
+        else:
+            print(f"⚠️ Stato non valido: {state}")
+    
+    def play(self, state, duration=None):
+        """Accoda uno stato per duration secondi, poi si torna a idle; non blocca"""
+        if state in self.states:
+            self.timeline.play(state, duration)
         else:
             print(f"⚠️ Stato non valido: {state}")
     
+    def tick(self):
+        """Stato, frame corrente e secondi al prossimo cambio (None se nulla è in programma)"""
+        return self.timeline.tick()
+    
+    def frame_id(self, state, index=0):
+        """Indice nell'atlante del frame index di state (None se lo stato non ha immagini)"""
+        frames = self.animation(state)[0]
+        return frames[index % len(frames)] if frames else None
+    
     def get_current_image(self):
         """Ritorna l'immagine dello stato corrente"""
-        return self.images.get(self.current_state)
+        state, index, _ = self.tick()
+        frame_id = self.frame_id(state, index)
+        return self.source_frame(frame_id) if frame_id is not None else None
+    
+    def frame(self, state=None, width=300, dpr=1.0, index=None):
+        """Frame di uno stato alla larghezza data, costruito una volta e poi preso dalla cache"""
+        if state is None:
+            state, index, _ = self.tick()
+        frame_id = self.frame_id(state, index or 0)
+        if frame_id is None:
+            return None
+        key = (frame_id, width, dpr)
+        frame = self.frames.get(key)
+        if frame is not None:
+            return frame
+        
+        with self.frames_lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                return frame
+            start = time.perf_counter()
+            image = self.source_frame(frame_id)
+            # Su schermi HiDPI si scala ai pixel fisici, la UI lo mostra a width punti
+            size = (round(width * dpr), round(image.height * width * dpr / image.width))
+            frame = image.resize(size, Image.LANCZOS)
+            if self.convert_frame:
+                frame = self.convert_frame(frame)
+            self.frames[key] = frame
+            if metrics:
+                metrics.avatar_render.observe(time.perf_counter() - start, size=str(width))
+            return frame
+    
+    def prerender(self, width=300, dpr=1.0, background=True):
+        """Prepara i frame di tutti gli stati, di default in un thread in background"""
+        def build():
+            for state in self.states:
+                for index in range(len(self.animation(state)[0])):
+                    self.frame(state, width, dpr, index)
+        
+        if not background:
+            build()
+            return None
+        thread = threading.Thread(target=build, name="avatar-prerender", daemon=True)
+        thread.start()
+        return thread
+    
+    def invalidate(self, width=None, dpr=None):
+        """Scarta i frame che non sono per width/dpr (tutti se non specificati)"""
+        with self.frames_lock:
+            self.frames = {
+                key: frame for key, frame in self.frames.items()
+                if width is not None and key[1] == width and (dpr is None or key[2] == dpr)
+            }
     
     def animate_talking(self, duration=1.0):
         """Anima l'avatar mentre parla"""
         print(f"🗣️ Animazione talking per {duration} secondi...")
-        self.set_state("talking")
-        time.sleep(duration)
-        self.set_state("idle")
+        self.play("talking", duration)
     
     def animate_thinking(self, duration=2.0):
         """Anima l'avatar mentre pensa"""
         print(f"🤔 Animazione thinking per {duration} secondi...")
-        self.set_state("thinking")
-        time.sleep(duration)
-        self.set_state("idle")
+        self.play("thinking", duration)
     
     def animate_happy(self, duration=1.5):
         """Anima l'avatar felice"""
         print(f"😊 Animazione happy per {duration} secondi...")
-        self.set_state("happy")
-        time.sleep(duration)
-        self.set_state("idle")
+        self.play("happy", duration)
     
     def get_available_states(self):
         """Ritorna gli stati disponibili"""
-        return list(self.images.keys())
-
+        if self.pack is not None:
+            return [state for state in self.states if self.pack.animation(state)]
+        if not self.load_pixels:
+            return list(self.states)
+        return [state for state, path in self.states.items() if find_animation(path)]
 
 # Test dell'animator
 if __name__ == "__main__":
@@ -84,7 +253,7 @@ if __name__ == "__main__":
     animator = AvatarAnimator()
     
     # Verifica immagini caricate
-    if animator.images:
+    if animator.get_available_states():
         print(f"\n✅ Stati disponibili: {animator.get_available_states()}")
         
         # Test cambio stati
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Pacchetto degli asset dell'avatar: un solo file con indice e frame già decodificati.
+# Creazione: python src/avatar/asset_pack.py  (da rifare quando cambiano le immagini)
+import io
+import os
+import sys
+import mmap
+import json
+import struct
+import argparse
+from PIL import Image
+
+try:
+    from .atlas import FrameAtlas, load_animation, find_animation
+except ImportError:
+    from atlas import FrameAtlas, load_animation, find_animation
+
+MAGIC = b"AVPK1\n"
+
+PACK_PATH = "assets/avatar.pack"
+
+
+def build_pack(states, path=PACK_PATH, compress=False):
+    """Scrive il pacchetto: indice JSON degli stati, poi i frame deduplicati (RGBA grezzi o PNG)"""
+    atlas = FrameAtlas()
+    index = {"states": {}, "frames": []}
+    for state, image_path in states.items():
+        source = find_animation(image_path)
+        if source is None:
+            print(f"⚠️ File non trovato: {image_path}")
+            continue
+        frames, durations = load_animation(source, atlas)
+        index["states"][state] = {"frames": frames, "durations": durations, "source": source}
+
+    blobs = []
+    offset = 0
+    for frame_id in range(len(atlas)):
+        image = atlas.get(frame_id)
+        if compress:
+            buffer = io.BytesIO()
+            image.save(buffer, "PNG", optimize=True)
+            data, kind = buffer.getvalue(), "png"
+        else:
+            # RGBA grezzi: con mmap il frame si usa senza decodifica né copia
+            data, kind = image.tobytes(), "rgba"
+        index["frames"].append({"offset": offset, "length": len(data), "size": list(image.size), "format": kind})
+        blobs.append(data)
+        offset += len(data)
+
+    header = json.dumps(index, separators=(",", ":")).encode("utf-8")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Scrittura atomica: chi ha già mappato il vecchio file continua a leggerlo
+    temp = path + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        f.writelines(blobs)
+    os.replace(temp, path)
+    return index
+
+
+class AssetPack:
+    """Pacchetto mappato in memoria: all'apertura si legge solo l'indice, i pixel al primo uso"""
+
+    def __init__(self, path=PACK_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} non è un pacchetto avatar")
+        (length,) = struct.unpack_from("<I", self.data, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.index = json.loads(self.data[start:start + length])
+        self.base = start + length
+        self.images = {}
+
+    @property
+    def states(self):
+        return list(self.index["states"])
+
+    def animation(self, state):
+        """Indici dei frame e durate di uno stato, o None"""
+        entry = self.index["states"].get(state)
+        return (entry["frames"], entry["durations"]) if entry else None
+
+    def get(self, frame_id):
+        """Frame come immagine RGBA; i frame grezzi puntano direttamente alla memoria mappata"""
+        image = self.images.get(frame_id)
+        if image is None:
+            info = self.index["frames"][frame_id]
+            start = self.base + info["offset"]
+            view = memoryview(self.data)[start:start + info["length"]]
+            if info["format"] == "rgba":
+                image = Image.frombuffer("RGBA", tuple(info["size"]), view, "raw", "RGBA", 0, 1)
+            else:
+                image = Image.open(io.BytesIO(view))
+                image.load()
+            self.images[frame_id] = image
+        return image
+
+    def is_stale(self):
+        """Vero se qualche immagine sorgente è più recente del pacchetto"""
+        built = os.path.getmtime(self.path)
+        return any(
+            os.path.exists(entry["source"]) and os.path.getmtime(entry["source"]) > built
+            for entry in self.index["states"].values()
+        )
+
+    def __len__(self):
+        return len(self.index["frames"])
+
+
+def main():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from animator import DEFAULT_STATES
+
+    parser = argparse.ArgumentParser(description="Crea il pacchetto degli asset dell'avatar")
+    parser.add_argument("--output", default=os.getenv("AVATAR_PACK_PATH", PACK_PATH), help="file da creare")
+    parser.add_argument("--compress", action="store_true", help="frame in PNG invece che RGBA grezzi")
+    args = parser.parse_args()
+
+    index = build_pack(DEFAULT_STATES, args.output, args.compress)
+    size = os.path.getsize(args.output) / 1024
+    print(f"📦 {args.output}: {len(index['states'])} stati, {len(index['frames'])} frame, {size:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
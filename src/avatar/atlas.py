@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+import threading
+from PIL import Image
+
+# Durata dei frame quando il file non la indica (secondi)
+DEFAULT_FRAME_DURATION = 0.1
+
+# Varianti animate cercate accanto al PNG di ogni stato, in ordine di preferenza
+ANIMATED_EXTENSIONS = (".gif", ".apng")
+
+
+class FrameAtlas:
+    """Tutti i frame di tutti gli stati in un'unica immagine RGBA; i frame identici sono salvati una volta"""
+
+    def __init__(self, max_width=4096):
+        self.max_width = max_width
+        self.boxes = []
+        self.digests = {}
+        self.pending = []
+        self.image = None
+        self.lock = threading.RLock()
+
+    def add(self, image):
+        """Aggiunge un frame e ritorna il suo indice nell'atlante"""
+        image = image.convert("RGBA")
+        digest = hashlib.sha1(image.tobytes() + repr(image.size).encode()).digest()
+        with self.lock:
+            index = self.digests.get(digest)
+            if index is None:
+                index = self.digests[digest] = len(self.boxes)
+                self.boxes.append(None)
+                self.pending.append((index, image))
+            return index
+
+    def build(self):
+        """Impacchetta i frame a scaffali (righe di altezza simile) in un'unica immagine"""
+        with self.lock:
+            if not self.pending:
+                return self.image
+            frames = list(self.pending)
+            if self.image is not None:
+                # Frame aggiunti dopo: si reimpacchetta tutto
+                frames += [(i, self.image.crop(box)) for i, box in enumerate(self.boxes) if box is not None]
+            frames.sort(key=lambda f: -f[1].height)
+            width = max(self.max_width, max(image.width for _, image in frames))
+
+            x = y = shelf = 0
+            for index, image in frames:
+                if x + image.width > width:
+                    x, y, shelf = 0, y + shelf, 0
+                self.boxes[index] = (x, y, x + image.width, y + image.height)
+                x += image.width
+                shelf = max(shelf, image.height)
+
+            atlas = Image.new("RGBA", (max(box[2] for box in self.boxes), y + shelf))
+            for index, image in frames:
+                atlas.paste(image, self.boxes[index][:2])
+            self.image = atlas
+            self.pending = []
+            return atlas
+
+    def get(self, index):
+        """Frame index come immagine RGBA a sé stante"""
+        with self.lock:
+            # Uno stato caricato dopo aggiunge frame: si reimpacchetta prima di leggere
+            if self.pending:
+                self.build()
+            return self.image.crop(self.boxes[index])
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+def find_animation(path):
+    """File da cui caricare uno stato: la variante animata se c'è, altrimenti path (None se manca)"""
+    base = os.path.splitext(path)[0]
+    candidates = [base + ext for ext in ANIMATED_EXTENSIONS] + [path]
+    return next((p for p in candidates if os.path.exists(p)), None)
+
+
+def load_animation(path, atlas):
+    """Frame e durate di uno stato: sprite sheet (con .json accanto), GIF/APNG animata o immagine statica"""
+    image = Image.open(path)
+    sheet = os.path.splitext(path)[0] + ".json"
+
+    if os.path.exists(sheet):
+        # Es. {"columns": 8, "rows": 1, "frames": 8, "fps": 12}
+        with open(sheet, encoding="utf-8") as f:
+            spec = json.load(f)
+        columns, rows = spec.get("columns", 1), spec.get("rows", 1)
+        width, height = image.width // columns, image.height // rows
+        count = spec.get("frames", columns * rows)
+        frames = [
+            image.crop(((i % columns) * width, (i // columns) * height,
+                        (i % columns + 1) * width, (i // columns + 1) * height))
+            for i in range(count)
+        ]
+        durations = [1 / spec["fps"] if spec.get("fps") else DEFAULT_FRAME_DURATION] * count
+    elif getattr(image, "n_frames", 1) > 1:
+        frames, durations = [], []
+        for i in range(image.n_frames):
+            image.seek(i)
+            frames.append(image.convert("RGBA"))
+            durations.append((image.info.get("duration") or DEFAULT_FRAME_DURATION * 1000) / 1000)
+    else:
+        frames, durations = [image], [0.0]
+
+    return [atlas.add(frame) for frame in frames], durations
@@ -0,0 +1,93 @@
+import io
+import os
+import hashlib
+import threading
+from PIL import Image, features
+
+MIMETYPES = {"webp": "image/webp", "png": "image/png"}
+
+
+class EncodedFrames:
+    """Immagini dell'avatar per il browser, codificate una volta per stato, larghezza e formato"""
+
+    def __init__(self, animator, sizes=None, formats=None):
+        self.animator = animator
+        sizes = sizes or os.getenv("AVATAR_WEB_SIZES", "96,160,320")
+        self.sizes = sorted(int(s) for s in sizes.split(",")) if isinstance(sizes, str) else sorted(sizes)
+        # PNG sempre, WebP se Pillow lo supporta
+        formats = formats or ("webp", "png")
+        self.formats = [f for f in formats if f != "webp" or features.check("webp")]
+
+        # digest -> (byte, mimetype); stato -> larghezza -> formato -> digest
+        self.files = {}
+        self.index = {}
+        self.version = None
+        self.lock = threading.Lock()
+
+    def prepare(self):
+        """Codifica tutti gli stati (una sola volta; le chiamate successive non fanno nulla)"""
+        with self.lock:
+            if self.version is not None:
+                return
+            for state in self.animator.get_available_states():
+                frames, durations = self.animator.animation(state)
+                if not frames:
+                    continue
+                sources = [self.animator.source_frame(frame_id) for frame_id in frames]
+                for size in self.sizes:
+                    images = [self._resize(image, size) for image in sources]
+                    for fmt in self.formats:
+                        data = self._encode(images, durations, fmt)
+                        digest = hashlib.sha256(data).hexdigest()[:20]
+                        self.files[digest] = (data, MIMETYPES[fmt])
+                        self.index.setdefault(state, {}).setdefault(size, {})[fmt] = digest
+            self.version = hashlib.sha256(repr(sorted(self.files)).encode()).hexdigest()[:20]
+            print(f"🖼️ Avatar per il web: {len(self.files)} immagini pronte")
+
+    def start(self):
+        """Avvia prepare() in un thread in background"""
+        thread = threading.Thread(target=self.prepare, name="avatar-encoder", daemon=True)
+        thread.start()
+        return thread
+
+    def manifest(self, prefix):
+        """URL di ogni stato per larghezza e formato; gli URL contengono l'hash del contenuto"""
+        self.prepare()
+        return {
+            "version": self.version,
+            "sizes": self.sizes,
+            "formats": self.formats,
+            "states": {
+                state: {
+                    str(size): {fmt: f"{prefix}/{digest}.{fmt}" for fmt, digest in by_format.items()}
+                    for size, by_format in by_size.items()
+                }
+                for state, by_size in self.index.items()
+            }
+        }
+
+    def get(self, digest, fmt=None):
+        """(byte, mimetype) di un'immagine, o None; con fmt solo se l'immagine è in quel formato"""
+        self.prepare()
+        image = self.files.get(digest)
+        # Un URL .png non deve servire (e far mettere in cache per sempre) byte WebP
+        if image is None or (fmt is not None and MIMETYPES.get(fmt) != image[1]):
+            return None
+        return image
+
+    @staticmethod
+    def _resize(image, width):
+        height = round(image.height * width / image.width)
+        return image.convert("RGBA").resize((width, height), Image.LANCZOS)
+
+    @staticmethod
+    def _encode(images, durations, fmt):
+        buffer = io.BytesIO()
+        options = {"quality": 90, "method": 6} if fmt == "webp" else {"optimize": True}
+        if len(images) > 1:
+            # Animazioni come WebP animato o APNG: il browser le riproduce da solo
+            images[0].save(buffer, fmt.upper(), save_all=True, append_images=images[1:], loop=0,
+                           duration=[max(20, round(d * 1000)) for d in durations], **options)
+        else:
+            images[0].save(buffer, fmt.upper(), **options)
+        return buffer.getvalue()
@@ -0,0 +1,136 @@
+import time
+import asyncio
+import threading
+from collections import deque
+
+# Intervallo massimo tra due controlli della coda quando nessun frame è in scadenza (secondi)
+IDLE_POLL = 0.25
+
+
+class Timeline:
+    """Orologio delle animazioni: stato e frame dipendono dal tempo trascorso, senza sleep"""
+
+    def __init__(self, durations, state="idle", default="idle", on_change=None, clock=time.monotonic):
+        # Funzione stato -> durata in secondi di ogni frame ([0.0] = immagine statica)
+        self.durations = durations
+        self.default = default
+        self.on_change = on_change
+        self.clock = clock
+
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.counters = {"frames": 0, "skipped": 0, "transitions": 0}
+
+        self.state = state
+        self.started = clock()
+        self.hold = None
+        self.position = 0
+
+    def play(self, state, duration=None):
+        """Accoda state per duration secondi (None = fino alla prossima transizione); poi si torna a default"""
+        with self.lock:
+            self.queue.append((state, duration))
+        self.wakeup.set()
+
+    def set(self, state):
+        """Passa subito a state, scartando le transizioni in coda"""
+        with self.lock:
+            self.queue.clear()
+            changed = self._switch(state, None, self.clock())
+        self.wakeup.set()
+        if changed and self.on_change:
+            self.on_change(state)
+
+    def tick(self, now=None):
+        """Avanza all'istante now; ritorna (stato, frame, secondi al prossimo cambio o None)"""
+        # Se chi guida la timeline è in ritardo i frame intermedi vengono saltati, non recuperati
+        now = self.clock() if now is None else now
+        changes = []
+        with self.lock:
+            while True:
+                if self.hold is not None and now >= self.started + self.hold:
+                    # La transizione parte quando finisce la precedente, non quando arriva il tick
+                    end = self.started + self.hold
+                    state, hold = self.queue.popleft() if self.queue else (self.default, None)
+                elif self.hold is None and self.queue:
+                    end = now
+                    state, hold = self.queue.popleft()
+                else:
+                    break
+                if self._switch(state, hold, end):
+                    changes.append(state)
+
+            index, position, delay = self._frame_at(now - self.started)
+            if position != self.position:
+                self.counters["frames"] += 1
+                self.counters["skipped"] += max(0, position - self.position - 1)
+                self.position = position
+            if self.hold is not None:
+                remaining = self.started + self.hold - now
+                delay = remaining if delay is None else min(delay, remaining)
+            state = self.state
+
+        if self.on_change:
+            for changed in changes:
+                self.on_change(changed)
+        return state, index, delay
+
+    def run(self, on_frame):
+        """Guida la timeline da un thread: on_frame(stato, frame) solo quando il frame cambia"""
+        last = None
+        while not self.stopped:
+            state, index, delay = self.tick()
+            if (state, index) != last:
+                last = (state, index)
+                on_frame(state, index)
+            self.wakeup.wait(IDLE_POLL if delay is None else min(delay, IDLE_POLL))
+            self.wakeup.clear()
+
+    def start(self, on_frame):
+        """Avvia run() in un thread in background"""
+        self.stopped = False
+        thread = threading.Thread(target=self.run, args=(on_frame,), name="avatar-timeline", daemon=True)
+        thread.start()
+        return thread
+
+    async def run_async(self, on_frame):
+        """Come run(), sull'event loop asyncio"""
+        last = None
+        while not self.stopped:
+            state, index, delay = self.tick()
+            if (state, index) != last:
+                last = (state, index)
+                on_frame(state, index)
+            await asyncio.sleep(IDLE_POLL if delay is None else min(delay, IDLE_POLL))
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, state=self.state, queued=len(self.queue))
+
+    def _switch(self, state, hold, when):
+        changed = state != self.state
+        self.state, self.hold, self.started = state, hold, when
+        self.position = 0
+        if changed:
+            self.counters["transitions"] += 1
+        return changed
+
+    def _frame_at(self, elapsed):
+        """Frame dello stato corrente dopo elapsed secondi: (indice, frame assoluti, secondi al prossimo)"""
+        durations = self.durations(self.state) or [0.0]
+        total = sum(durations)
+        if len(durations) < 2 or total <= 0:
+            return 0, 0, None
+        cycles, offset = divmod(max(0.0, elapsed), total)
+        end = 0.0
+        for index, duration in enumerate(durations):
+            end += duration
+            if offset < end:
+                return index, int(cycles) * len(durations) + index, end - offset
+        return len(durations) - 1, int(cycles + 1) * len(durations) - 1, total - offset
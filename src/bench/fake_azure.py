@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# Server finto che imita l'API chat-completions di Azure OpenAI, per benchmark senza rete.
+# Avvio: python src/bench/fake_azure.py  (poi AZURE_AI_FAKE_URL=http://127.0.0.1:8765)
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+from flask import Flask, Response, request, jsonify, stream_with_context
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+try:
+    from ..ai.rate_limiter import RateLimiter
+except Exception:
+    from src.ai.rate_limiter import RateLimiter
+
+app = Flask(__name__)
+
+WORDS = ("certo", "ecco", "una", "risposta", "simulata", "per", "il", "tuo", "test", "di", "carico",
+         "con", "qualche", "parola", "in", "più", "così", "da", "avere", "token", "realistici")
+
+
+def parse_distribution(spec):
+    """Campionatore da una stringa: fixed:S, uniform:A:B, normal:MEDIA:SD, lognormal:MEDIANA:SIGMA"""
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(args[0], args[1]))
+    if kind == "lognormal":
+        # Code lunghe come le latenze reali: mediana args[0]
+        return lambda: args[0] * random.lognormvariate(0, args[1])
+    raise ValueError(f"Distribuzione sconosciuta: {spec}")
+
+
+class FakeAzureConfig:
+    """Parametri del server finto, da variabili d'ambiente FAKE_AZURE_*"""
+
+    def __init__(self):
+        # Tempo fino al primo token
+        self.latency = parse_distribution(os.getenv("FAKE_AZURE_LATENCY", "lognormal:0.4:0.5"))
+        # Velocità di generazione (token al secondo) e lunghezza delle risposte
+        self.tokens_per_second = float(os.getenv("FAKE_AZURE_TOKENS_PER_SECOND", 60))
+        self.response_tokens = parse_distribution(os.getenv("FAKE_AZURE_RESPONSE_TOKENS", "uniform:20:120"))
+        # Errori iniettati: frazione di risposte 500 e 429
+        self.error_rate = float(os.getenv("FAKE_AZURE_ERROR_RATE", 0))
+        self.throttle_rate = float(os.getenv("FAKE_AZURE_429_RATE", 0))
+        # Quote reali, come quelle di un deployment (0 = illimitate)
+        self.limiter = RateLimiter(
+            name="fake-azure",
+            rpm=float(os.getenv("FAKE_AZURE_RPM", 0)),
+            tpm=float(os.getenv("FAKE_AZURE_TPM", 0))
+        )
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "streamed": 0, "errors": 0, "throttled": 0, "tokens": 0}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+
+config = FakeAzureConfig()
+
+
+def count_tokens(messages):
+    # Stima grossolana: circa 4 caratteri per token, più l'overhead di ogni messaggio
+    return sum(len(m.get("content") or "") // 4 + 4 for m in messages)
+
+
+def make_answer(messages, tokens):
+    question = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    words = [f"[{question[:40]}]"] + [random.choice(WORDS) for _ in range(max(1, tokens - 1))]
+    return words
+
+
+def ratelimit_headers():
+    stats = config.limiter.stats()
+    levels = config.limiter.levels
+    headers = {}
+    for kind, limit in (("requests", stats["rpm"]), ("tokens", stats["tpm"])):
+        if limit:
+            headers[f"x-ratelimit-limit-{kind}"] = str(int(limit))
+            headers[f"x-ratelimit-remaining-{kind}"] = str(max(0, int(levels[kind])))
+    return headers
+
+
+def error_response(status, code, message, headers=None):
+    return jsonify({"error": {"code": code, "message": message}}), status, headers or {}
+
+
+@app.route('/', methods=['GET', 'HEAD'])
+def index():
+    # Usata dal warm-up delle connessioni
+    return jsonify({"status": "ok", "server": "fake-azure"})
+
+
+@app.route('/stats')
+def stats():
+    with config.lock:
+        return jsonify(dict(config.counters))
+
+
+@app.route('/openai/deployments/<deployment>/chat/completions', methods=['POST'])
+def chat_completions(deployment):
+    body = request.get_json(force=True)
+    messages = body.get("messages", [])
+    stream = bool(body.get("stream"))
+    include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+    max_tokens = int(body.get("max_tokens") or 500)
+    config.count("requests")
+
+    prompt_tokens = count_tokens(messages)
+    completion_tokens = max(1, min(max_tokens, int(config.response_tokens())))
+
+    if random.random() < config.throttle_rate:
+        config.count("throttled")
+        return error_response(429, "429", "Rate limit simulato", {"retry-after-ms": "1000", "retry-after": "1"})
+    wait = config.limiter._take(prompt_tokens + completion_tokens)
+    if wait > 0:
+        config.count("throttled")
+        return error_response(429, "429", "Quota del deployment esaurita",
+                              {"retry-after-ms": str(int(wait * 1000)), "retry-after": str(max(1, round(wait)))})
+    if random.random() < config.error_rate:
+        config.count("errors")
+        time.sleep(config.latency())
+        return error_response(500, "InternalServerError", "Errore simulato")
+
+    config.count("tokens", prompt_tokens + completion_tokens)
+    words = make_answer(messages, completion_tokens)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": 0}
+    }
+    completion_id = f"chatcmpl-fake-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    headers = dict(ratelimit_headers(), **{"x-request-id": completion_id})
+    ttft = config.latency()
+
+    if not stream:
+        time.sleep(ttft + completion_tokens / config.tokens_per_second)
+        return jsonify({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": deployment,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(words)},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        }), 200, headers
+
+    config.count("streamed")
+
+    def chunk(choices, extra=None):
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                   "model": deployment, "choices": choices}
+        payload.update(extra or {})
+        return f"data: {json.dumps(payload)}\n\n"
+
+    def generate():
+        time.sleep(ttft)
+        yield chunk([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for i, word in enumerate(words):
+            time.sleep(1 / config.tokens_per_second)
+            text = word if i == 0 else " " + word
+            yield chunk([{"index": 0, "delta": {"content": text}, "finish_reason": None}])
+        yield chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if include_usage:
+            # Come Azure: ultimo chunk senza choices, con l'uso dei token
+            yield chunk([], {"usage": usage})
+        yield "data: [DONE]\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+
+if __name__ == '__main__':
+    port = int(os.getenv('FAKE_AZURE_PORT', 8765))
+    print(f"🧪 Azure finto su http://127.0.0.1:{port}")
+    app.run(host='127.0.0.1', port=port, debug=False, threaded=True)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# Benchmark di carico degli endpoint web contro il server Azure finto.
+# Esempio: python src/bench/load_test.py --servers gunicorn-sync,gunicorn-threaded,uvicorn-async --concurrency 32
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+import httpx
+import psutil
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# Configurazioni del server web da confrontare: {workers}, {threads} e {port} vengono sostituiti
+SERVERS = {
+    "gunicorn-sync": ["gunicorn", "-w", "{workers}", "-b", "127.0.0.1:{port}", "src.web.app:app"],
+    "gunicorn-threaded": ["gunicorn", "-w", "{workers}", "-k", "gthread", "--threads", "{threads}",
+                          "-b", "127.0.0.1:{port}", "src.web.app:app"],
+    "uvicorn-async": ["uvicorn", "--workers", "{workers}", "--host", "127.0.0.1", "--port", "{port}",
+                      "src.web.asgi_app:app"],
+}
+
+PROMPTS = [
+    "Ciao! Come stai?",
+    "Puoi spiegarmi le list comprehension in Python?",
+    "Che differenza c'è tra un processo e un thread?",
+    "Dammi tre idee per una cena veloce",
+    "Grazie mille!",
+]
+
+TASKS = ["Organizza la mia settimana", "Prepara una lista della spesa", "Riassumi le email di oggi"]
+
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def request_for(endpoint):
+    """Metodo, percorso e corpo di una richiesta verso endpoint"""
+    if endpoint == "chat":
+        return "POST", "/api/chat", {"message": random.choice(PROMPTS), "no_cache": True}
+    if endpoint == "task":
+        return "POST", "/api/task", {"task": random.choice(TASKS)}
+    return "GET", "/api/status", None
+
+
+async def run_endpoint(base_url, endpoint, concurrency, duration, timeout):
+    """Genera carico su un endpoint per duration secondi con concurrency utenti in parallelo"""
+    latencies = []
+    errors = {}
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        async def user():
+            # Ogni utente virtuale ha la sua sessione
+            headers = {"X-Session-Id": uuid.uuid4().hex}
+            while time.monotonic() < deadline:
+                method, path, body = request_for(endpoint)
+                start = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body, headers=headers)
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                elapsed = time.perf_counter() - start
+                if status == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        wall = time.monotonic() - started
+
+    total = len(latencies) + sum(errors.values())
+    return {
+        "requests": total,
+        "throughput": round(len(latencies) / wall, 2) if wall else 0,
+        "error_rate": round(sum(errors.values()) / total, 4) if total else 0,
+        "errors": errors,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": sum(latencies) / len(latencies) if latencies else None
+    }
+
+
+class MemorySampler:
+    """Campiona la RSS del master e dei worker del server durante il test"""
+
+    def __init__(self, pid):
+        self.process = psutil.Process(pid)
+        self.peak = {}
+        self.task = None
+
+    def sample(self):
+        try:
+            processes = [self.process] + self.process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return
+        for process in processes:
+            try:
+                rss = process.memory_info().rss
+            except psutil.NoSuchProcess:
+                continue
+            self.peak[process.pid] = max(self.peak.get(process.pid, 0), rss)
+
+    async def run(self, interval=0.5):
+        while True:
+            self.sample()
+            await asyncio.sleep(interval)
+
+    def report(self):
+        workers = {pid: rss for pid, rss in self.peak.items() if pid != self.process.pid}
+        # Con un solo processo (es. uvicorn senza --workers) il master è anche il worker
+        workers = workers or dict(self.peak)
+        mb = lambda b: round(b / 1024 / 1024, 1)
+        return {
+            "master_mb": mb(self.peak.get(self.process.pid, 0)),
+            "workers": len(workers),
+            "per_worker_mb": [mb(rss) for rss in sorted(workers.values())],
+            "max_worker_mb": mb(max(workers.values())) if workers else None,
+            "total_mb": mb(sum(self.peak.values()))
+        }
+
+
+def start_process(command, env, port, name):
+    """Avvia un processo e attende che risponda sulla porta"""
+    # L'output va in un file temporaneo: se il server non parte se ne mostra la fine
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except httpx.HTTPError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    process.wait()
+    log.seek(0)
+    output = log.read().decode("utf-8", "replace").strip().splitlines()[-15:]
+    raise RuntimeError(f"❌ {name} non si è avviato sulla porta {port}:\n" + "\n".join(output))
+
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def bench_server(name, args, env):
+    command = [part.format(workers=args.workers, threads=args.threads, port=args.port) for part in SERVERS[name]]
+    print(f"\n🚀 {name}: {' '.join(command)}")
+    server = start_process(command, env, args.port, name)
+    sampler = MemorySampler(server.pid)
+    sampler.task = asyncio.create_task(sampler.run())
+    results = {}
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        for endpoint in args.endpoints:
+            # Breve riscaldamento, escluso dai risultati
+            await run_endpoint(base_url, endpoint, min(args.concurrency, 4), args.warmup, args.timeout)
+            results[endpoint] = await run_endpoint(base_url, endpoint, args.concurrency, args.duration, args.timeout)
+            stats = results[endpoint]
+            print(f"   {endpoint:7s} {stats['throughput']:8.1f} req/s  p50 {fmt(stats['p50'])}  "
+                  f"p95 {fmt(stats['p95'])}  p99 {fmt(stats['p99'])}  errori {stats['error_rate']:.1%}")
+    finally:
+        sampler.task.cancel()
+        sampler.sample()
+        stop_process(server)
+    memory = sampler.report()
+    print(f"   memoria: {memory['max_worker_mb']} MB per worker (max), {memory['total_mb']} MB totali")
+    return {"command": command, "endpoints": results, "memory": memory}
+
+
+def fmt(seconds):
+    return f"{seconds * 1000:7.0f}ms" if seconds is not None else "      -"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark di carico degli endpoint web")
+    parser.add_argument("--servers", default=",".join(SERVERS), help="configurazioni da confrontare")
+    parser.add_argument("--endpoints", default="chat,status,task", help="endpoint da testare")
+    parser.add_argument("--concurrency", type=int, default=16, help="utenti virtuali in parallelo")
+    parser.add_argument("--duration", type=float, default=20, help="secondi di carico per endpoint")
+    parser.add_argument("--warmup", type=float, default=2, help="secondi di riscaldamento per endpoint")
+    parser.add_argument("--workers", type=int, default=2, help="processi worker del server")
+    parser.add_argument("--threads", type=int, default=8, help="thread per worker (gthread)")
+    parser.add_argument("--timeout", type=float, default=60, help="timeout delle richieste")
+    parser.add_argument("--port", type=int, default=5050, help="porta del server web")
+    parser.add_argument("--upstream", help="URL di un server Azure finto già avviato")
+    parser.add_argument("--upstream-port", type=int, default=8765, help="porta del server Azure finto")
+    parser.add_argument("--output", default=os.path.join(ROOT, "data", "benchmarks"), help="cartella dei risultati")
+    args = parser.parse_args()
+    args.servers = [s for s in args.servers.split(",") if s]
+    args.endpoints = [e for e in args.endpoints.split(",") if e]
+    unknown = set(args.servers) - set(SERVERS)
+    if unknown:
+        parser.error(f"server sconosciuti: {', '.join(sorted(unknown))}")
+    return args
+
+
+async def main():
+    args = parse_args()
+    upstream = None
+    upstream_url = args.upstream
+    if not upstream_url:
+        upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+        upstream = start_process([sys.executable, os.path.join("src", "bench", "fake_azure.py")],
+                                 dict(os.environ, FAKE_AZURE_PORT=str(args.upstream_port)),
+                                 args.upstream_port, "fake_azure")
+
+    # I server web parlano con il server finto; niente cache per misurare il percorso completo
+    env = dict(os.environ, AZURE_AI_FAKE_URL=upstream_url, AZURE_AI_CACHE="0", AZURE_AI_SEMANTIC_CACHE="0",
+               PYTHONUNBUFFERED="1")
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "settings": {k: v for k, v in vars(args).items() if k != "output"},
+        "upstream": {k: v for k, v in os.environ.items() if k.startswith("FAKE_AZURE_")},
+        "servers": {}
+    }
+    try:
+        for name in args.servers:
+            report["servers"][name] = await bench_server(name, args, env)
+    finally:
+        if upstream:
+            stop_process(upstream)
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Risultati salvati in {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
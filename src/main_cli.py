@@ -11,7 +11,7 @@ def main():
     print("="*60 + "\n")
     
     try:
-        animator = AvatarAnimator()
+        animator = AvatarAnimator(load_pixels=False)
         ai_client = AzureAIClient()
         
         print("✅ Assistente pronto!\n")
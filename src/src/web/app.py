@@ -2,8 +2,11 @@
 import os
 import sys
 import json
+import time
+import uuid
+from contextlib import closing
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, session, stream_with_context, g
 from dotenv import load_dotenv
 
 # Carica variabili
@@ -12,21 +15,68 @@ load_dotenv()
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 
 from src.avatar.animator import AvatarAnimator
+from src.avatar.frame_encoder import EncodedFrames
 from src.ai.azure_client import AzureAIClient
 from src.utils.self_improvement import SelfImprovementEngine
+from src.utils.session_store import SessionStore
+from src.ai.cancellation import CancelRegistry
+from src.ai.deadline import Deadline
+from src.ai.metrics import metrics, CONTENT_TYPE
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key')
 
+# Limiti per /api/chat/batch
+BATCH_MAX_PROMPTS = int(os.getenv('BATCH_MAX_PROMPTS', 100))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 16))
+
+# Budget di tempo per richiesta (sotto il timeout di 30s dei worker gunicorn)
+CHAT_DEADLINE = float(os.getenv('CHAT_DEADLINE', 25))
+STREAM_DEADLINE = float(os.getenv('STREAM_DEADLINE', 25))
+BATCH_DEADLINE = float(os.getenv('BATCH_DEADLINE', 25))
+
+# Le immagini dell'avatar hanno l'hash del contenuto nell'URL: il browser non le richiede più
+AVATAR_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
 # Inizializza componenti
 try:
+    # I pixel dell'avatar si decodificano una sola volta, per codificare le immagini del browser
     animator = AvatarAnimator()
+    avatar_frames = EncodedFrames(animator)
+    avatar_frames.start()
     ai_client = AzureAIClient()
     improvement_engine = SelfImprovementEngine(ai_client)
+    # Una storia per ogni sessione invece di una globale
+    session_store = SessionStore(ai_client.new_history)
+    # Richieste in corso, annullabili con /api/chat/cancel
+    cancel_registry = CancelRegistry()
+    metrics.sessions.set_function(lambda: session_store.stats()['active_sessions'])
     print("✅ Componenti inizializzati")
 except Exception as e:
     print(f"❌ Errore inizializzazione: {e}")
 
+@app.before_request
+def start_timer():
+    """Avvia il cronometro della richiesta"""
+    g.start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Registra la durata della richiesta (per lo streaming: fino agli header)"""
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.http_request.observe(time.perf_counter() - g.start, route=route,
+                                 method=request.method, status=response.status_code)
+    return response
+
+def get_session_id():
+    """Id della sessione: token del client o cookie di sessione Flask"""
+    token = request.headers.get('X-Session-Id')
+    if token:
+        return token
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
 @app.route('/')
 def index():
     """Homepage"""
@@ -43,7 +93,11 @@ def chat():
             return jsonify({'error': 'Empty message'}), 400
         
         # Ottieni risposta AI
-        response = ai_client.chat(user_message)
+        deadline = Deadline(CHAT_DEADLINE)
+        session_id = get_session_id()
+        with cancel_registry.track(session_id) as cancel, session_store.session(session_id) as history:
+            response = ai_client.chat(user_message, history, use_cache=not data.get('no_cache'),
+                                      cancel=cancel, deadline=deadline, session_id=session_id)
         
         # Impara dalla conversazione
         satisfaction = improvement_engine.learn_from_conversation(
@@ -54,6 +108,91 @@ def chat():
         return jsonify({
             'response': response,
             'satisfaction': satisfaction,
+            'degraded': deadline.degraded,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def sse_event(payload, event=None):
+    """Formatta un evento Server-Sent Events"""
+    lines = f"event: {event}\n" if event else ""
+    return lines + f"data: {json.dumps(payload)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Chat endpoint in streaming (SSE)"""
+    data = request.json or {}
+    user_message = data.get('message', '')
+    
+    if not user_message:
+        return jsonify({'error': 'Empty message'}), 400
+    
+    session_id = get_session_id()
+    use_cache = not data.get('no_cache')
+    deadline = Deadline(STREAM_DEADLINE)
+    
+    def generate():
+        parts = []
+        try:
+            # Inoltra i token man mano che arrivano; se il client si disconnette
+            # la yield solleva GeneratorExit e closing() chiude la chiamata upstream
+            with cancel_registry.track(session_id) as cancel, session_store.session(session_id) as history:
+                with closing(ai_client.chat_stream(user_message, history, use_cache, cancel, deadline,
+                                                   session_id)) as stream:
+                    for delta in stream:
+                        parts.append(delta)
+                        yield sse_event({'delta': delta})
+            
+            response = ''.join(parts)
+            
+            # Impara dalla conversazione
+            satisfaction = improvement_engine.learn_from_conversation(
+                user_message,
+                response
+            )
+            
+            yield sse_event({
+                'response': response,
+                'satisfaction': satisfaction,
+                'cancelled': cancel.is_set(),
+                'degraded': deadline.degraded,
+                'timestamp': datetime.now().isoformat()
+            }, event='done')
+        except Exception as e:
+            yield sse_event({'error': str(e)}, event='error')
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/chat/cancel', methods=['POST'])
+def chat_cancel():
+    """Interrompe le risposte in corso della sessione"""
+    cancelled = cancel_registry.cancel(get_session_id())
+    return jsonify({'status': 'cancelled' if cancelled else 'idle', 'requests': cancelled})
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """Chat su più prompt indipendenti in parallelo"""
+    try:
+        data = request.json or {}
+        prompts = data.get('prompts', [])
+        
+        if not prompts or not isinstance(prompts, list):
+            return jsonify({'error': 'Empty prompts'}), 400
+        if len(prompts) > BATCH_MAX_PROMPTS:
+            return jsonify({'error': f'Too many prompts (max {BATCH_MAX_PROMPTS})'}), 400
+        
+        concurrency = min(int(data.get('concurrency', 4)), BATCH_MAX_CONCURRENCY)
+        results = ai_client.chat_many(prompts, concurrency, use_cache=not data.get('no_cache'),
+                                       deadline=Deadline(BATCH_DEADLINE), session_id=get_session_id())
+        
+        return jsonify({
+            'results': results,
             'timestamp': datetime.now().isoformat()
         })
     
@@ -66,11 +205,75 @@ def status():
     try:
         status_data = improvement_engine.get_status()
         status_data['avatar_state'] = animator.current_state
+        status_data['sessions'] = session_store.stats()
+        status_data['backends'] = ai_client.pool.stats()
+        status_data['prefix_cache'] = ai_client.prefix_cache.stats()
+        if ai_client.router:
+            status_data['routing'] = ai_client.router.stats()
+        if ai_client.cache:
+            status_data['cache'] = ai_client.cache.stats()
+        if ai_client.semantic_cache:
+            status_data['semantic_cache'] = ai_client.semantic_cache.stats()
+        if ai_client.flights:
+            status_data['coalescing'] = ai_client.flights.stats()
+        if ai_client.ledger:
+            status_data['usage'] = ai_client.ledger.stats()
         
         return jsonify(status_data)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/avatar/manifest')
+def avatar_manifest():
+    """URL delle immagini di ogni stato dell'avatar, per dimensione e formato"""
+    manifest = avatar_frames.manifest('/api/avatar')
+    if request.if_none_match.contains(manifest['version']):
+        return Response(status=304, headers={'ETag': f'"{manifest["version"]}"'})
+    response = jsonify(manifest)
+    response.set_etag(manifest['version'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/avatar/<digest>.<fmt>')
+def avatar_image(digest, fmt):
+    """Immagine dell'avatar pre-codificata, con ETag e cache immutabile"""
+    image = avatar_frames.get(digest, fmt)
+    if image is None:
+        return jsonify({'error': 'Not found'}), 404
+    headers = {'ETag': f'"{digest}"', 'Cache-Control': AVATAR_CACHE_CONTROL}
+    if request.if_none_match.contains(digest):
+        return Response(status=304, headers=headers)
+    return Response(image[0], mimetype=image[1], headers=headers)
+
+@app.route('/api/usage')
+def usage():
+    """Token usati dalla sessione e aggregati per deployment e giorno"""
+    if not ai_client.ledger:
+        return jsonify({'error': 'Usage ledger disabled'}), 404
+    days = min(int(request.args.get('days', 7)), 90)
+    ledger = ai_client.ledger
+    session_id = get_session_id()
+    return jsonify({
+        'session': {
+            'used_today': ledger.used_today(session_id),
+            'daily_budget': ledger.daily_budget or None,
+            'days': ledger.summary('session', session_id, days)
+        },
+        'deployments': ledger.summary('deployment', days=days),
+        'days': ledger.summary('day', days=days)
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metriche in formato Prometheus (per worker)"""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/reset', methods=['POST'])
+def reset():
+    """Reset della conversazione della sessione corrente"""
+    session_store.reset(get_session_id())
+    return jsonify({'status': 'reset'})
+
 @app.route('/api/improve', methods=['POST'])
 def improve():
     """Avvia auto-miglioramento"""
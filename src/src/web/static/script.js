@@ -8,15 +8,40 @@ class AssistantApp {
         this.executeBtn = document.getElementById('execute-btn');
         this.statusBtn = document.getElementById('status-btn');
         this.avatarEmoji = document.getElementById('avatar-emoji');
+        this.avatarImage = document.getElementById('avatar-image');
+        this.avatarFrames = {};
         this.statusText = document.getElementById('status-text');
         this.statsModal = document.getElementById('stats-modal');
         
         this.setupEventListeners();
         this.addWelcomeMessage();
+        this.loadAvatar();
+    }
+    
+    async loadAvatar() {
+        // Precarica le immagini di tutti gli stati: cambiare stato poi non richiede nulla al server
+        try {
+            const manifest = await (await fetch('/api/avatar/manifest')).json();
+            
+            // La dimensione più piccola che resta nitida su questo schermo
+            const target = this.avatarImage.width * (window.devicePixelRatio || 1);
+            const size = manifest.sizes.find(s => s >= target) || manifest.sizes[manifest.sizes.length - 1];
+            
+            await Promise.allSettled(Object.entries(manifest.states).map(async ([state, sizes]) => {
+                const image = new Image();
+                image.src = sizes[size].webp || sizes[size].png;
+                await image.decode();
+                this.avatarFrames[state] = image.src;
+            }));
+            this.showAvatar('idle');
+        } catch (error) {
+            // Senza immagini resta l'emoji
+        }
     }
     
     setupEventListeners() {
-        this.sendBtn.addEventListener('click', () => this.sendMessage());
+        // Durante una risposta il pulsante di invio diventa "Stop"
+        this.sendBtn.addEventListener('click', () => this.controller ? this.stop() : this.sendMessage());
         this.userInput.addEventListener('keypress', (e) => {
             if (e.key === 'Enter' && e.ctrlKey) this.sendMessage();
         });
@@ -36,32 +61,86 @@ class AssistantApp {
     
     async sendMessage() {
         const message = this.userInput.value.trim();
-        if (!message) return;
+        if (!message || this.controller) return;
         
         this.addMessage(message, 'user');
         this.userInput.value = '';
         
-        this.setStatus('Penso...', '🤔');
+        this.setStatus('Penso...', '🤔', 'thinking');
+        this.controller = new AbortController();
+        this.sendBtn.textContent = '⏹️ Stop';
         
         try {
-            const response = await fetch('/api/chat', {
+            const response = await fetch('/api/chat/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ message })
+                body: JSON.stringify({ message }),
+                signal: this.controller.signal
             });
             
-            const data = await response.json();
+            // Bolla vuota riempita man mano che arrivano i token
+            const bubble = this.addMessage('', 'assistant');
+            
+            await this.readStream(response, (event, data) => {
+                if (event === 'error') throw new Error(data.error);
+                if (data.delta) {
+                    if (!bubble.textContent) this.setStatus('Parlo...', '🗣️', 'talking');
+                    bubble.textContent += data.delta;
+                    this.messagesContainer.scrollTop = this.messagesContainer.scrollHeight;
+                }
+            });
             
-            this.addMessage(data.response, 'assistant');
-            this.setStatus('Pronto', '😊');
+            // Felice per un attimo, poi di nuovo a riposo
+            this.setStatus('Pronto', '😊', 'happy');
+            setTimeout(() => { if (!this.controller) this.showAvatar('idle'); }, 1500);
         } catch (error) {
-            this.addMessage('❌ Errore: ' + error.message, 'assistant');
-            this.setStatus('Errore', '⚠️');
+            if (error.name === 'AbortError') {
+                this.setStatus('Interrotto', '⏹️');
+            } else {
+                this.addMessage('❌ Errore: ' + error.message, 'assistant');
+                this.setStatus('Errore', '⚠️');
+            }
+        } finally {
+            this.controller = null;
+            this.sendBtn.textContent = '📤 Invia';
+        }
+    }
+    
+    stop() {
+        // Chiude la connessione (il server interrompe la chiamata ad Azure)
+        // e avvisa il server, nel caso un proxy non inoltri la disconnessione
+        this.controller.abort();
+        fetch('/api/chat/cancel', { method: 'POST' });
+    }
+    
+    async readStream(response, onEvent) {
+        // Legge una risposta text/event-stream e chiama onEvent per ogni evento
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            
+            for (const raw of events) {
+                let event = 'message';
+                let data = '';
+                for (const line of raw.split('\n')) {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                if (data) onEvent(event, JSON.parse(data));
+            }
         }
     }
     
     async improve() {
-        this.setStatus('Miglioramento...', '🔧');
+        this.setStatus('Miglioramento...', '🔧', 'thinking');
         
         try {
             const response = await fetch('/api/improve', { method: 'POST' });
@@ -70,7 +149,7 @@ class AssistantApp {
             this.addMessage('✨ Auto-miglioramento completato!\n' + 
                           'Miglioramenti: ' + data.improvements.improvements.join(', '), 
                           'assistant');
-            this.setStatus('Migliorato', '✨');
+            this.setStatus('Migliorato', '✨', 'happy');
         } catch (error) {
             this.addMessage('❌ Errore miglioramento', 'assistant');
         }
@@ -80,7 +159,7 @@ class AssistantApp {
         const task = prompt('Descrivi il compito:');
         if (!task) return;
         
-        this.setStatus('Esecuzione...', '🚀');
+        this.setStatus('Esecuzione...', '🚀', 'thinking');
         
         try {
             const response = await fetch('/api/task', {
@@ -93,7 +172,7 @@ class AssistantApp {
             this.addMessage('✅ Compito eseguito!\nPiano: ' + 
                           data.plan.actions.join(', '), 
                           'assistant');
-            this.setStatus('Completato', '✅');
+            this.setStatus('Completato', '✅', 'happy');
         } catch (error) {
             this.addMessage('❌ Errore esecuzione', 'assistant');
         }
@@ -125,11 +204,22 @@ class AssistantApp {
         msgDiv.textContent = text;
         this.messagesContainer.appendChild(msgDiv);
         this.messagesContainer.scrollTop = this.messagesContainer.scrollHeight;
+        return msgDiv;
     }
     
-    setStatus(text, emoji) {
+    setStatus(text, emoji, state = 'idle') {
         this.statusText.textContent = text;
         this.avatarEmoji.textContent = emoji;
+        this.showAvatar(state);
+    }
+    
+    showAvatar(state) {
+        // Immagine già decodificata: nessuna richiesta, l'emoji resta se non ci sono immagini
+        const src = this.avatarFrames[state] || this.avatarFrames.idle;
+        if (!src) return;
+        this.avatarImage.src = src;
+        this.avatarImage.hidden = false;
+        this.avatarEmoji.hidden = true;
     }
 }
 
@@ -1,19 +1,28 @@
 import sys
 import os
 import json
-import time
 from datetime import datetime
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QLabel, QTextEdit, 
                              QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QScrollArea)
 from PyQt6.QtCore import Qt, QTimer
 from PyQt6.QtGui import QPixmap, QImage, QFont
-import numpy as np
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from avatar.animator import AvatarAnimator
 from ai.azure_client import AzureAIClient
 
+AVATAR_WIDTH = 300
+
+
+def to_qimage(image):
+    """Converte un'immagine PIL RGBA in QImage (sicuro anche fuori dal thread della UI)"""
+    data = image.tobytes("raw", "RGBA")
+    q_image = QImage(data, image.width, image.height, 4 * image.width, QImage.Format.Format_RGBA8888)
+    # copy() fa possedere i pixel a QImage, indipendentemente dal buffer data
+    return q_image.copy()
+
+
 class ChatWindow(QMainWindow):
     """Finestra di chat interattiva con avatar animato"""
     
@@ -22,7 +31,15 @@ class ChatWindow(QMainWindow):
         
         try:
             print("🎨 Inizializzazione avatar...")
-            self.animator = AvatarAnimator()
+            self.animator = AvatarAnimator(convert_frame=to_qimage)
+            # Frame di tutti gli stati preparati in background: cambiare stato è solo uno scambio di pixmap
+            self.avatar_width = AVATAR_WIDTH
+            self.pixmaps = {}
+            self.animator.prerender(self.avatar_width, self.devicePixelRatioF())
+            # Il timer Qt fa avanzare le animazioni: se la UI è in ritardo si saltano frame
+            self.avatar_timer = QTimer(self)
+            self.avatar_timer.setSingleShot(True)
+            self.avatar_timer.timeout.connect(self.update_avatar)
             print("✅ Avatar pronto!")
             
             print("🧠 Inizializzazione AI...")
@@ -142,16 +159,13 @@ class ChatWindow(QMainWindow):
             # Mostra risposta
             self.add_message(response, "assistant")
             
-            # Status: felice
-            self.animator.set_state("happy")
-            self.update_avatar()
-            time.sleep(0.5)
+            # Status: felice per un attimo, poi torna a idle da solo senza bloccare la UI
+            self.animator.play("happy", 1.5)
             
         except Exception as e:
             self.add_message(f"❌ Errore: {str(e)}", "assistant")
+            self.animator.set_state("idle")
         
-        # Ritorna a idle
-        self.animator.set_state("idle")
         self.update_avatar()
         self.status_label.setText("😊 Pronto!")
     
@@ -188,27 +202,38 @@ class ChatWindow(QMainWindow):
         self.chat_container.adjustSize()
     
     def update_avatar(self):
-        """Aggiorna avatar display"""
+        """Aggiorna avatar display e programma il prossimo frame"""
         try:
-            image = self.animator.get_current_image()
-            if image:
-                img_array = np.array(image.convert('RGBA'))
-                height, width, channel = img_array.shape
-                bytes_per_line = 4 * width
-                
-                q_image = QImage(
-                    img_array.tobytes(),
-                    width,
-                    height,
-                    bytes_per_line,
-                    QImage.Format.Format_RGBA8888
-                )
-                
-                pixmap = QPixmap.fromImage(q_image)
-                pixmap = pixmap.scaledToWidth(300, Qt.TransformationMode.SmoothTransformation)
-                self.avatar_label.setPixmap(pixmap)
+            state, index, delay = self.animator.tick()
+            if delay is not None:
+                self.avatar_timer.start(max(1, round(delay * 1000)))
+            
+            dpr = self.devicePixelRatioF()
+            key = (self.animator.frame_id(state, index), self.avatar_width, dpr)
+            if key[0] is None:
+                return
+            pixmap = self.pixmaps.get(key)
+            if pixmap is None:
+                # QPixmap si crea solo nel thread della UI, una volta per frame
+                pixmap = QPixmap.fromImage(self.animator.frame(state, self.avatar_width, dpr, index))
+                pixmap.setDevicePixelRatio(dpr)
+                self.pixmaps[key] = pixmap
+            self.avatar_label.setPixmap(pixmap)
         except Exception as e:
             print(f"❌ Errore avatar: {e}")
+    
+    def resizeEvent(self, event):
+        """Ridimensiona l'avatar con la finestra e scarta i frame della vecchia dimensione"""
+        super().resizeEvent(event)
+        if not hasattr(self, "avatar_label"):
+            return
+        width = max(120, min(AVATAR_WIDTH, self.width() // 3))
+        if width != self.avatar_width:
+            self.avatar_width = width
+            self.pixmaps.clear()
+            self.animator.invalidate(width)
+            self.animator.prerender(width, self.devicePixelRatioF())
+            self.update_avatar()
 
 def main():
     app = QApplication(sys.argv)
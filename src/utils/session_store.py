@@ -0,0 +1,218 @@
+import os
+import asyncio
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+
+class _Session:
+    """Una conversazione residente in memoria"""
+
+    def __init__(self, history):
+        self.history = history
+        self.size = history_size(history)
+        self.last_access = time.time()
+        self.lock = threading.Lock()
+        self.in_use = 0
+        # Chi attende il lock da asyncio: (loop, future) svegliati al rilascio
+        self.waiters = []
+        self.waiters_lock = threading.Lock()
+
+    def release(self):
+        """Rilascia il lock e sveglia chi lo attende da asyncio"""
+        self.lock.release()
+        with self.waiters_lock:
+            waiters, self.waiters = self.waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    async def acquire_async(self):
+        """Prende il lock senza bloccare l'event loop e senza polling"""
+        loop = asyncio.get_running_loop()
+        while not self.lock.acquire(blocking=False):
+            waiter = (loop, loop.create_future())
+            with self.waiters_lock:
+                self.waiters.append(waiter)
+            try:
+                # Il lock può essersi liberato prima che ci registrassimo
+                if self.lock.acquire(blocking=False):
+                    return
+                await waiter[1]
+            finally:
+                with self.waiters_lock:
+                    if waiter in self.waiters:
+                        self.waiters.remove(waiter)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def history_size(history):
+    """Stima in byte la memoria occupata da una storia"""
+    return sum(len(m.get("content") or "") * 2 + 64 for m in history)
+
+
+class SessionStore:
+    """Storia delle conversazioni per sessione, con limite LRU, TTL e paging su disco"""
+
+    def __init__(self, factory, max_sessions=None, ttl=None, max_bytes=None, storage_dir=None):
+        # factory() crea la storia iniziale di una nuova sessione
+        self.factory = factory
+        self.max_sessions = max_sessions or int(os.getenv("SESSION_MAX", 500))
+        self.ttl = ttl or float(os.getenv("SESSION_TTL", 1800))
+        self.max_bytes = max_bytes or int(float(os.getenv("SESSION_MAX_MB", 64)) * 1024 * 1024)
+        self.storage_dir = storage_dir or os.getenv("SESSION_DIR", "data/sessions")
+
+        self.sessions = OrderedDict()
+        # Sessioni uscite dalla memoria ma non ancora scritte su disco: id -> JSON
+        self.paging = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.last_sweep = time.time()
+        self.stats_counters = {"created": 0, "loaded": 0, "paged_out": 0}
+
+        os.makedirs(self.storage_dir, exist_ok=True)
+
+    @contextmanager
+    def session(self, session_id):
+        """Ritorna la storia della sessione, bloccata per la durata del blocco with"""
+        entry = self._acquire(session_id)
+        try:
+            entry.lock.acquire()
+            try:
+                yield entry.history
+            finally:
+                entry.release()
+        finally:
+            self._release(session_id, entry)
+
+    @asynccontextmanager
+    async def asession(self, session_id):
+        """Come session(), ma attende il lock della sessione senza bloccare l'event loop"""
+        entry = self._acquire(session_id)
+        try:
+            await entry.acquire_async()
+            try:
+                yield entry.history
+            finally:
+                entry.release()
+        finally:
+            self._release(session_id, entry)
+
+    def reset(self, session_id):
+        """Cancella la storia della sessione, in memoria e su disco"""
+        with self.lock:
+            entry = self.sessions.pop(session_id, None)
+            if entry:
+                self.total_bytes -= entry.size
+            self.paging.pop(session_id, None)
+            # Sotto il lock: una scrittura in corso non può ricreare il file dopo la cancellazione
+            path = self._path(session_id)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def stats(self):
+        """Ritorna statistiche sulle sessioni"""
+        with self.lock:
+            return {
+                "active_sessions": len(self.sessions),
+                "memory_bytes": self.total_bytes,
+                **self.stats_counters
+            }
+
+    def _acquire(self, session_id):
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                entry = _Session(self._load(session_id))
+                self.sessions[session_id] = entry
+                self.total_bytes += entry.size
+            self.sessions.move_to_end(session_id)
+            entry.in_use += 1
+            entry.last_access = time.time()
+            return entry
+
+    def _release(self, session_id, entry):
+        with self.lock:
+            entry.in_use -= 1
+            size = history_size(entry.history)
+            if self.sessions.get(session_id) is entry:
+                self.total_bytes += size - entry.size
+            entry.size = size
+            paged = self._enforce_limits()
+        # Le scritture su disco avvengono fuori dal lock, senza bloccare le altre sessioni
+        for paged_id in paged:
+            self._write(paged_id)
+
+    def _load(self, session_id):
+        data = self.paging.pop(session_id, None)
+        if data is not None:
+            # Uscita dalla memoria ma non ancora scritta: si riprende da qui
+            self.stats_counters["loaded"] += 1
+            return json.loads(data)
+        path = self._path(session_id)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    history = json.load(f)
+                os.remove(path)
+                self.stats_counters["loaded"] += 1
+                return history
+            except Exception as e:
+                print(f"⚠️ Sessione su disco illeggibile ({path}): {e}")
+        self.stats_counters["created"] += 1
+        return self.factory()
+
+    def _page_out(self, session_id, entry):
+        """Rimuove la sessione dalla memoria; la scrittura su disco la fa _write() fuori dal lock"""
+        del self.sessions[session_id]
+        self.total_bytes -= entry.size
+        self.paging[session_id] = json.dumps(entry.history, ensure_ascii=False)
+        self.stats_counters["paged_out"] += 1
+        return session_id
+
+    def _write(self, session_id):
+        with self.lock:
+            data = self.paging.get(session_id)
+        if data is None:
+            return
+        path = self._path(session_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        with self.lock:
+            # Nel frattempo la sessione può essere stata ricaricata o cancellata
+            if self.paging.get(session_id) is data:
+                os.replace(tmp_path, path)
+                del self.paging[session_id]
+                return
+        os.remove(tmp_path)
+
+    def _enforce_limits(self):
+        """Toglie dalla memoria le sessioni in eccesso; ritorna quelle da scrivere su disco"""
+        now = time.time()
+        paged = []
+
+        # Sessioni inattive: controllo al massimo una volta ogni 30 secondi
+        if now - self.last_sweep > 30:
+            self.last_sweep = now
+            for session_id, entry in list(self.sessions.items()):
+                if entry.in_use == 0 and now - entry.last_access > self.ttl:
+                    paged.append(self._page_out(session_id, entry))
+
+        # Troppe sessioni o troppa memoria: via le meno usate di recente
+        for session_id, entry in list(self.sessions.items()):
+            if len(self.sessions) <= self.max_sessions and self.total_bytes <= self.max_bytes:
+                break
+            if entry.in_use == 0:
+                paged.append(self._page_out(session_id, entry))
+        return paged
+
+    def _path(self, session_id):
+        name = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.storage_dir, f"{name}.json")
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# Versione asincrona (ASGI) della web app: un solo processo serve molte chat in parallelo.
+# Avvio: uvicorn src.web.asgi_app:app --host 0.0.0.0 --port 5000
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+from datetime import datetime
+from quart import Quart, Response, render_template, request, jsonify, session, g
+from dotenv import load_dotenv
+
+load_dotenv()
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+try:
+    # Prefer package-relative imports when the module is executed as part of the package
+    from ..avatar.animator import AvatarAnimator
+    from ..avatar.frame_encoder import EncodedFrames
+    from ..ai.async_azure_client import AsyncAzureAIClient
+    from ..utils.self_improvement import SelfImprovementEngine
+    from ..utils.session_store import SessionStore
+    from ..ai.http_pool import warm_up_async, keep_alive_async
+    from ..ai.cancellation import CancelRegistry
+    from ..ai.deadline import Deadline
+    from ..ai.metrics import metrics, CONTENT_TYPE
+except Exception:
+    # Fallback to absolute imports when running the module as a script or in environments
+    # where package-relative imports are not supported
+    from src.avatar.animator import AvatarAnimator
+    from src.avatar.frame_encoder import EncodedFrames
+    from src.ai.async_azure_client import AsyncAzureAIClient
+    from src.utils.self_improvement import SelfImprovementEngine
+    from src.utils.session_store import SessionStore
+    from src.ai.http_pool import warm_up_async, keep_alive_async
+    from src.ai.cancellation import CancelRegistry
+    from src.ai.deadline import Deadline
+    from src.ai.metrics import metrics, CONTENT_TYPE
+
+app = Quart(__name__, template_folder='templates', static_folder='static')
+app.secret_key = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key')
+BATCH_MAX_PROMPTS = int(os.getenv('BATCH_MAX_PROMPTS', 100))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 16))
+# Budget di tempo per richiesta
+CHAT_DEADLINE = float(os.getenv('CHAT_DEADLINE', 25))
+STREAM_DEADLINE = float(os.getenv('STREAM_DEADLINE', 25))
+BATCH_DEADLINE = float(os.getenv('BATCH_DEADLINE', 25))
+# Immagini dell'avatar: l'URL contiene l'hash del contenuto, quindi non cambiano mai
+AVATAR_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+try:
+    # I pixel dell'avatar si decodificano una sola volta, per codificare le immagini del browser
+    animator = AvatarAnimator()
+    avatar_frames = EncodedFrames(animator)
+    avatar_frames.start()
+    ai_client = AsyncAzureAIClient()
+    improvement_engine = SelfImprovementEngine(ai_client)
+    session_store = SessionStore(ai_client.new_history)
+    cancel_registry = CancelRegistry()
+    metrics.sessions.set_function(lambda: session_store.stats()['active_sessions'])
+    print("✅ Componenti inizializzati")
+except Exception as e:
+    print(f"❌ Errore: {e}")
+
+@app.before_serving
+async def warm_connections():
+    # Il client HTTP asincrono va scaldato dentro l'event loop che lo userà
+    await warm_up_async(ai_client.pool.endpoints)
+    app.keep_alive = asyncio.create_task(keep_alive_async(ai_client.pool.endpoints))
+
+@app.after_serving
+async def stop_keep_alive():
+    app.keep_alive.cancel()
+
+@app.before_request
+async def start_timer():
+    g.start = time.perf_counter()
+
+@app.after_request
+async def record_request(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.http_request.observe(time.perf_counter() - g.start, route=route,
+                                 method=request.method, status=response.status_code)
+    return response
+
+def get_session_id():
+    token = request.headers.get('X-Session-Id')
+    if token:
+        return token
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+def sse_event(payload, event=None):
+    lines = f"event: {event}\n" if event else ""
+    return lines + f"data: {json.dumps(payload)}\n\n"
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+@app.route('/api/chat', methods=['POST'])
+async def chat():
+    try:
+        data = await request.get_json()
+        user_message = data.get('message', '')
+        if not user_message:
+            return jsonify({'error': 'Empty message'}), 400
+        deadline = Deadline(CHAT_DEADLINE)
+        session_id = get_session_id()
+        with cancel_registry.track(session_id) as cancel:
+            async with session_store.asession(session_id) as history:
+                response = await ai_client.achat(user_message, history, use_cache=not data.get('no_cache'),
+                                                 cancel=cancel, deadline=deadline, session_id=session_id)
+        # Il motore di apprendimento è sincrono: gira in un thread per non bloccare l'event loop
+        satisfaction = await asyncio.to_thread(improvement_engine.learn_from_conversation, user_message, response)
+        return jsonify({
+            'response': response,
+            'satisfaction': satisfaction,
+            'degraded': deadline.degraded,
+            'timestamp': datetime.now().isoformat()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chat/stream', methods=['POST'])
+async def chat_stream():
+    data = await request.get_json() or {}
+    user_message = data.get('message', '')
+    if not user_message:
+        return jsonify({'error': 'Empty message'}), 400
+
+    session_id = get_session_id()
+    use_cache = not data.get('no_cache')
+    deadline = Deadline(STREAM_DEADLINE)
+
+    async def generate():
+        parts = []
+        try:
+            # Client disconnesso: Quart annulla il generatore (CancelledError) e la chiamata upstream si chiude
+            with cancel_registry.track(session_id) as cancel:
+                async with session_store.asession(session_id) as history:
+                    stream = ai_client.achat_stream(user_message, history, use_cache, cancel, deadline,
+                                                    session_id)
+                    try:
+                        async for delta in stream:
+                            parts.append(delta)
+                            yield sse_event({'delta': delta})
+                    finally:
+                        await stream.aclose()
+            response = ''.join(parts)
+            satisfaction = await asyncio.to_thread(improvement_engine.learn_from_conversation, user_message, response)
+            yield sse_event({
+                'response': response,
+                'satisfaction': satisfaction,
+                'cancelled': cancel.is_set(),
+                'degraded': deadline.degraded,
+                'timestamp': datetime.now().isoformat()
+            }, event='done')
+        except Exception as e:
+            yield sse_event({'error': str(e)}, event='error')
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.timeout = None
+    return response
+
+@app.route('/api/chat/cancel', methods=['POST'])
+async def chat_cancel():
+    cancelled = cancel_registry.cancel(get_session_id())
+    return jsonify({'status': 'cancelled' if cancelled else 'idle', 'requests': cancelled})
+
+@app.route('/api/chat/batch', methods=['POST'])
+async def chat_batch():
+    try:
+        data = await request.get_json() or {}
+        prompts = data.get('prompts', [])
+        if not prompts or not isinstance(prompts, list):
+            return jsonify({'error': 'Empty prompts'}), 400
+        if len(prompts) > BATCH_MAX_PROMPTS:
+            return jsonify({'error': f'Too many prompts (max {BATCH_MAX_PROMPTS})'}), 400
+        concurrency = min(int(data.get('concurrency', 4)), BATCH_MAX_CONCURRENCY)
+        results = await ai_client.achat_many(prompts, concurrency, use_cache=not data.get('no_cache'),
+                                             deadline=Deadline(BATCH_DEADLINE), session_id=get_session_id())
+        return jsonify({
+            'results': results,
+            'timestamp': datetime.now().isoformat()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/status')
+async def status():
+    try:
+        status_data = await asyncio.to_thread(improvement_engine.get_status)
+        status_data['avatar_state'] = animator.current_state
+        status_data['sessions'] = session_store.stats()
+        status_data['backends'] = ai_client.pool.stats()
+        status_data['prefix_cache'] = ai_client.prefix_cache.stats()
+        if ai_client.router:
+            status_data['routing'] = ai_client.router.stats()
+        if ai_client.cache:
+            status_data['cache'] = ai_client.cache.stats()
+        if ai_client.semantic_cache:
+            status_data['semantic_cache'] = ai_client.semantic_cache.stats()
+        if ai_client.async_flights:
+            status_data['coalescing'] = ai_client.async_flights.stats()
+        if ai_client.ledger:
+            status_data['usage'] = await asyncio.to_thread(ai_client.ledger.stats)
+        return jsonify(status_data)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/task', methods=['POST'])
+async def execute_task():
+    try:
+        data = await request.get_json()
+        task = data.get('task', '')
+        plan = await asyncio.to_thread(improvement_engine.execute_autonomous_task, task)
+        return jsonify({
+            'plan': plan,
+            'status': 'executing'
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/avatar/manifest')
+async def avatar_manifest():
+    manifest = await asyncio.to_thread(avatar_frames.manifest, '/api/avatar')
+    if request.if_none_match.contains(manifest['version']):
+        return Response('', status=304, headers={'ETag': f'"{manifest["version"]}"'})
+    response = jsonify(manifest)
+    response.set_etag(manifest['version'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/avatar/<digest>.<fmt>')
+async def avatar_image(digest, fmt):
+    image = await asyncio.to_thread(avatar_frames.get, digest, fmt)
+    if image is None:
+        return jsonify({'error': 'Not found'}), 404
+    headers = {'ETag': f'"{digest}"', 'Cache-Control': AVATAR_CACHE_CONTROL}
+    if request.if_none_match.contains(digest):
+        return Response('', status=304, headers=headers)
+    return Response(image[0], mimetype=image[1], headers=headers)
+
+@app.route('/api/usage')
+async def usage():
+    if not ai_client.ledger:
+        return jsonify({'error': 'Usage ledger disabled'}), 404
+    days = min(int(request.args.get('days', 7)), 90)
+    ledger = ai_client.ledger
+    session_id = get_session_id()
+
+    def report():
+        return {
+            'session': {
+                'used_today': ledger.used_today(session_id),
+                'daily_budget': ledger.daily_budget or None,
+                'days': ledger.summary('session', session_id, days)
+            },
+            'deployments': ledger.summary('deployment', days=days),
+            'days': ledger.summary('day', days=days)
+        }
+
+    return jsonify(await asyncio.to_thread(report))
+
+@app.route('/metrics')
+async def prometheus_metrics():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+@app.route('/api/reset', methods=['POST'])
+async def reset():
+    session_store.reset(get_session_id())
+    return jsonify({'status': 'reset'})
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 5000))
+    app.run(host='0.0.0.0', port=port, debug=False)
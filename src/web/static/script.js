@@ -5,12 +5,32 @@ class AssistantApp {
         this.userInput = document.getElementById('user-input');
         this.sendBtn = document.getElementById('send-btn');
         this.avatarEmoji = document.getElementById('avatar-emoji');
+        this.avatarImage = document.getElementById('avatar-image');
+        this.avatarFrames = {};
         this.statusText = document.getElementById('status-text');
         this.setupEventListeners();
         this.addWelcomeMessage();
+        this.loadAvatar();
+    }
+    async loadAvatar() {
+        // Precarica tutti gli stati: cambiare stato poi non richiede nulla al server
+        try {
+            const manifest = await (await fetch('/api/avatar/manifest')).json();
+            const target = this.avatarImage.width * (window.devicePixelRatio || 1);
+            const size = manifest.sizes.find(s => s >= target) || manifest.sizes[manifest.sizes.length - 1];
+            await Promise.allSettled(Object.entries(manifest.states).map(async ([state, sizes]) => {
+                const image = new Image();
+                image.src = sizes[size].webp || sizes[size].png;
+                await image.decode();
+                this.avatarFrames[state] = image.src;
+            }));
+            this.showAvatar('idle');
+        } catch (error) {
+            // Senza immagini resta l'emoji
+        }
     }
     setupEventListeners() {
-        this.sendBtn.addEventListener('click', () => this.sendMessage());
+        this.sendBtn.addEventListener('click', () => this.controller ? this.stop() : this.sendMessage());
         this.userInput.addEventListener('keypress', (e) => {
             if (e.key === 'Enter' && e.ctrlKey) this.sendMessage();
         });
@@ -20,21 +40,61 @@ class AssistantApp {
     }
     async sendMessage() {
         const message = this.userInput.value.trim();
-        if (!message) return;
+        if (!message || this.controller) return;
         this.addMessage(message, 'user');
         this.userInput.value = '';
-        this.setStatus('Penso...', '🤔');
+        this.setStatus('Penso...', '🤔', 'thinking');
+        this.controller = new AbortController();
+        this.sendBtn.textContent = '⏹️ Stop';
         try {
-            const response = await fetch('/api/chat', {
+            const response = await fetch('/api/chat/stream', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ message })
+                body: JSON.stringify({ message }),
+                signal: this.controller.signal
+            });
+            const bubble = this.addMessage('', 'assistant');
+            await this.readStream(response, (event, data) => {
+                if (event === 'error') throw new Error(data.error);
+                if (data.delta) {
+                    if (!bubble.textContent) this.setStatus('Parlo...', '🗣️', 'talking');
+                    bubble.textContent += data.delta;
+                    this.messagesContainer.scrollTop = this.messagesContainer.scrollHeight;
+                }
             });
-            const data = await response.json();
-            this.addMessage(data.response, 'assistant');
-            this.setStatus('Pronto', '😊');
+            this.setStatus('Pronto', '😊', 'happy');
+            setTimeout(() => { if (!this.controller) this.showAvatar('idle'); }, 1500);
         } catch (error) {
-            this.addMessage('❌ Errore: ' + error.message, 'assistant');
+            if (error.name === 'AbortError') this.setStatus('Interrotto', '⏹️');
+            else this.addMessage('❌ Errore: ' + error.message, 'assistant');
+        } finally {
+            this.controller = null;
+            this.sendBtn.textContent = '📤 Invia';
+        }
+    }
+    stop() {
+        // Chiude la connessione e avvisa il server, anche se un proxy non inoltra la disconnessione
+        this.controller.abort();
+        fetch('/api/chat/cancel', { method: 'POST' });
+    }
+    async readStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            for (const raw of events) {
+                let event = 'message', data = '';
+                for (const line of raw.split('\n')) {
+                    if (line.startsWith('event: ')) event = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                }
+                if (data) onEvent(event, JSON.parse(data));
+            }
         }
     }
     addMessage(text, sender) {
@@ -43,10 +103,19 @@ class AssistantApp {
         msgDiv.textContent = text;
         this.messagesContainer.appendChild(msgDiv);
         this.messagesContainer.scrollTop = this.messagesContainer.scrollHeight;
+        return msgDiv;
     }
-    setStatus(text, emoji) {
+    setStatus(text, emoji, state = 'idle') {
         this.statusText.textContent = text;
         this.avatarEmoji.textContent = emoji;
+        this.showAvatar(state);
+    }
+    showAvatar(state) {
+        const src = this.avatarFrames[state] || this.avatarFrames.idle;
+        if (!src) return;
+        this.avatarImage.src = src;
+        this.avatarImage.hidden = false;
+        this.avatarEmoji.hidden = true;
     }
 }
 document.addEventListener('DOMContentLoaded', () => { new AssistantApp(); });